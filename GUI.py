@@ -1,46 +1,66 @@
 import pygame
 
 class Text:
-    def __init__(self, font: pygame.font.Font, text, color):
+    def __init__(self, font: pygame.font.Font, text, color, background = None):
         self.color = color
+        self.background = background
         self.font = font
         self.text = text
-        self.rendered_text = self.font.render(self.text, True, color)
+        self.rendered_text = self.font.render(self.text, True, color, background)
         self.width, self.height = self.rendered_text.get_width(), self.rendered_text.get_height()
 
+    def set_text(self, text):
+        # re-rendering is the expensive part, so it only happens when the text actually changes
+        if text != self.text:
+            self.text = text
+            self.rendered_text = self.font.render(self.text, True, self.color, self.background)
+            self.width, self.height = self.rendered_text.get_width(), self.rendered_text.get_height()
+
+# window events after which whatever was on screen has to be drawn again
+EXPOSE_EVENTS = {pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED, pygame.WINDOWSHOWN, pygame.WINDOWRESTORED}
+
 class Button:
-    def __init__(self, screen, x, y, width, height, color, color_hover, text, func):
+    def __init__(self, screen, x, y, width, height, color, color_hover, text, func, image: pygame.Surface = None):
         self.screen: pygame.Surface = screen
         self.x, self.y = x, y
         self.width, self.height = width, height
+        self.rect = pygame.Rect(x, y, width, height)
         self.text: Text = text
         self.color, self.color_hover = color, color_hover
         self.func = func
-        self.is_clicked = False
-    
-    @property
-    def rect(self):
-        return pygame.Rect(self.x, self.y, self.width, self.height)
+        self.image = image      # optional picture on the left side of the button
+        self.hovered = False    # kept up to date from mouse events by GUI, instead of asking for the mouse every frame
+        self.surfaces = {}      # (hovered, text) -> the button drawn on its own surface, see render
+
+    def move(self, x, y):
+        self.x, self.y = x, y
+        self.rect.topleft = (x, y)
+
+    def set_hover(self, position):
+        # returns whether the hover state changed, i.e. whether the button needs to be drawn again
+        hovered = self.rect.collidepoint(position)
+        changed = hovered != self.hovered
+        self.hovered = hovered
+        return changed
 
-    @property
-    def is_mouse_colliding(self):
-        return self.rect.collidepoint(*pygame.mouse.get_pos())
+    def render(self):
+        # a button only ever looks two ways, so both are drawn once and then just blitted (GUI blits them all in one call)
+        key = (self.hovered, self.text.text)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            if len(self.surfaces) >= 2:
+                self.surfaces.clear()
+            surface = self.surfaces[key] = pygame.Surface((self.width, self.height))
+            surface.fill(self.color if not self.hovered else self.color_hover)
+            pygame.draw.rect(surface, "white", (0, 0, self.width, self.height), 1)
+            pygame.draw.rect(surface, "black", (1, 1, self.width - 2, self.height - 2), 1)
+            if self.image:
+                surface.blit(self.image, (5, self.height / 2 - self.image.get_height() / 2))
+            surface.blit(self.text.rendered_text, (self.width / 2 - self.text.width / 2, self.height / 2 - self.text.height / 2))
+        return surface
 
     def draw(self):
-        color = self.color if not self.is_mouse_colliding else self.color_hover
-        pygame.draw.rect(self.screen, color, self.rect)
-        pygame.draw.rect(self.screen, "white", self.rect, 1)
-        pygame.draw.rect(self.screen, "black", (self.x + 1, self.y + 1, self.width - 2, self.height - 2), 1)
-        self.screen.blit(self.text.rendered_text, (self.x + self.width / 2 - self.text.width / 2, self.y + self.height / 2 - self.text.height / 2))
-
-    def update(self):
-        if not self.is_clicked:
-            if self.is_mouse_colliding:
-                if pygame.mouse.get_pressed()[0]:
-                    self.is_clicked = True
-                    self.func()
-        if not pygame.mouse.get_pressed()[0]:
-            self.is_clicked = False
+        self.screen.blit(self.render(), self.rect)
 
 class Label:
     def __init__(self, screen, x, y, text):
@@ -51,18 +71,99 @@ class Label:
     def draw(self):
         self.screen.blit(self.text.rendered_text, (self.x, self.y))
 
+class ListView:
+    # Scrollable column of equally tall buttons. Only rows that are on screen exist as Buttons; make_row(index, x, y, width, height)
+    # builds one when it scrolls into view, so the list costs the same with ten rows or ten thousand.
+    def __init__(self, screen, x, y, width, height, row_height, make_row, count = 0):
+        self.screen: pygame.Surface = screen
+        self.x, self.y = x, y
+        self.width, self.height = width, height
+        self.row_height = row_height
+        self.make_row = make_row
+        self.count = count
+        self.scroll = 0
+        self.rows: dict[int, Button] = {}
+
+    def set_count(self, count):
+        self.count = count
+        self.scroll_by(0)
+        self.refresh()
+
+    def refresh(self):
+        # drop the built rows, e.g. when what they show changed
+        self.rows.clear()
+
+    def scroll_by(self, pixels):
+        # returns whether the list actually moved
+        scroll = self.scroll
+        self.scroll = min(max(0, self.scroll + pixels), max(0, self.count * self.row_height - self.height))
+        return self.scroll != scroll
+
+    def visible_rows(self):
+        first = self.scroll // self.row_height
+        return range(first, min(self.count, (self.scroll + self.height) // self.row_height + 1))
+
+    def visible_buttons(self):
+        visible = self.visible_rows()
+        for index in [index for index in self.rows if index not in visible]:
+            del self.rows[index]
+        for index in visible:
+            y = self.y + index * self.row_height - self.scroll
+            button = self.rows.get(index)
+            if button is None:
+                button = self.rows[index] = self.make_row(index, self.x, y, self.width, self.row_height)
+            elif button.y != y:
+                button.move(self.x, y)
+            yield button
+
+    def handle_event(self, event):
+        if event.type == pygame.MOUSEWHEEL:
+            return self.scroll_by(-event.y * self.row_height)
+        return False
+
+    def draw(self):
+        clip = self.screen.get_clip()
+        self.screen.set_clip((self.x, self.y, self.width, self.height))
+        self.screen.blits([(button.render(), button.rect) for button in self.visible_buttons()], False)
+        self.screen.set_clip(clip)
+
 class GUI:
     def __init__(self, screen):
         self.buttons: list[Button] = []
         self.labels: list[Label] = []
+        self.lists: list[ListView] = []
         self.screen = screen
+        self.mouse = (-1, -1)   # last known pointer position
+
+    def all_buttons(self):
+        yield from self.buttons
+        for list_view in self.lists:
+            yield from list_view.visible_buttons()
+
+    def hover(self, position):
+        self.mouse = position
+        # a list, not any(), so every button gets its state updated
+        return any([button.set_hover(position) for button in self.all_buttons()])
+
+    def handle_event(self, event):
+        # returns whether the GUI has to be drawn again
+        if event.type == pygame.MOUSEMOTION:
+            return self.hover(event.pos)
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            self.mouse = event.pos
+            for button in list(self.all_buttons()):
+                if button.rect.collidepoint(event.pos):
+                    button.func()
+                    return True     # the button may have done anything, including taking over the screen for a while
+            return False
+        if event.type == pygame.MOUSEWHEEL:
+            changed = any([list_view.handle_event(event) for list_view in self.lists])
+            return self.hover(self.mouse) or changed     # the rows moved under the pointer
+        return event.type in EXPOSE_EVENTS
 
-    def update(self):
-        for button in self.buttons:
-            button.update()
-    
     def draw(self):
-        for button in self.buttons:
-            button.draw()
-        for label in self.labels:
-            label.draw()
\ No newline at end of file
+        self.hover(self.mouse)      # rows that were just built don't know about the pointer yet
+        self.screen.blits([(button.render(), button.rect) for button in self.buttons], False)
+        for list_view in self.lists:
+            list_view.draw()
+        self.screen.blits([(label.text.rendered_text, (label.x, label.y)) for label in self.labels], False)
\ No newline at end of file
@@ -0,0 +1,94 @@
+import time
+STARTED_AT = time.perf_counter()    # twow imports this module first, so this is before pygame (most of the startup time) is imported
+
+import os
+import json
+import threading
+import pygame
+
+# Every setting the game reads, with the value used when settings.json doesn't have it
+# except physics_tick_rate (fixed physics steps per second), which defaults to fps like before the two were separate
+DEFAULT_SETTINGS = {"fps": 720,                 # render cap
+                    "max_substeps": 8,          # most physics steps run for one rendered frame, the rest of a slow frame is dropped
+                    "solver_iterations": 10,    # pymunk space.iterations
+                    "interpolate": True}        # draw the player between its last two physics states
+SETTINGS_PATH = "Resources/settings.json"
+
+def load_settings(path = SETTINGS_PATH):
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(path, "r") as file:
+            settings.update(json.load(file))
+    except (OSError, ValueError) as e:
+        print(f"Error loading settings, using defaults: {e}")
+    settings.setdefault("physics_tick_rate", settings["fps"])
+    return settings
+
+class Assets:
+    # Fonts, images and settings, loaded the first time something asks for them and shared by the whole process.
+    # Images are converted to the display's pixel format once a window exists, which makes blitting them a plain copy;
+    # one loaded before that is converted the next time it's asked for.
+    def __init__(self):
+        self.fonts = {}
+        self.images = {}            # (path, size) -> (surface, converted)
+        self.settings_cache = None  # (mtime, settings)
+        self.lock = threading.Lock()
+        self.preloading = None
+        self.first_frame = None
+
+    def font(self, path, size):
+        key = (path, size)
+        font = self.fonts.get(key)
+        if font is None:
+            with self.lock:
+                font = self.fonts.get(key)      # the preload thread may have got there first
+                if font is None:
+                    if not pygame.font.get_init():
+                        pygame.font.init()
+                    font = self.fonts[key] = pygame.font.Font(path, size)
+        return font
+
+    def image(self, path, size = None):
+        key = (path, size)
+        entry = self.images.get(key)
+        if entry is None or not entry[1] and pygame.display.get_surface() is not None:
+            with self.lock:
+                entry = self.images.get(key)
+                if entry and (entry[1] or pygame.display.get_surface() is None):
+                    return entry[0]
+                surface = entry[0] if entry else pygame.image.load(path)
+                if size is not None and surface.get_size() != tuple(size):
+                    surface = pygame.transform.scale(surface, size)
+                converted = pygame.display.get_surface() is not None
+                if converted:
+                    surface = surface.convert_alpha() if surface.get_flags() & pygame.SRCALPHA else surface.convert()
+                entry = self.images[key] = (surface, converted)
+        return entry[0]
+
+    def settings(self, path = SETTINGS_PATH):
+        # re-read only when the file changed, so starting a level doesn't hit the disk
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if self.settings_cache is None or self.settings_cache[0] != mtime:
+            self.settings_cache = (mtime, load_settings(path))
+        return dict(self.settings_cache[1])
+
+    def preload(self, fonts = (), images = ()):
+        # loads in a background thread, e.g. while the menu is up; fonts are (path, size), images (path, size or None)
+        def run():
+            self.settings()
+            for path, size in fonts:
+                self.font(path, size)
+            for path, size in images:
+                self.image(path, size)
+        self.preloading = threading.Thread(target = run, daemon = True)
+        self.preloading.start()
+
+    def frame_shown(self):
+        # called after a frame is on screen; the first call records how long startup took (bench.py startup reports it)
+        if self.first_frame is None:
+            self.first_frame = time.perf_counter() - STARTED_AT
+
+assets = Assets()
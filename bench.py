@@ -0,0 +1,406 @@
+import os
+import sys
+import time
+import json
+import random
+import platform
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from twow import Engine, Entity, InputState, KEY_BITS, ANY_KEY, OBJECT, KIND_COLORS, KIND_TEXTURES, load_level
+import pygame
+import pymunk
+import wowlvl
+
+try:
+    import resource
+except ImportError:     # not on Windows, peak memory is reported as null there
+    resource = None
+
+RIGHT, JUMP = KEY_BITS[pygame.K_d], KEY_BITS[pygame.K_SPACE] | ANY_KEY
+
+# metric -> whether bigger is better, used when comparing against a baseline
+METRICS = {"load_seconds": False, "cold_load_seconds": False, "streamed_load_seconds": False, "entities_per_second": True,
+           "ms_per_frame": False, "steps_per_second": True, "peak_rss_mb": False,
+           "bytes_per_entity": False, "entity_object_bytes": False, "deaths_per_second": True,
+           "import_seconds": False, "first_frame_seconds": False, "idle_cpu_percent": False,
+           "batched_ms": False, "sprite_speedup": True}
+
+def bench_load(level_file_path, repeats = 5):
+    # Best of a few runs of load_level into a fresh headless engine; the compiled copy is built beforehand.
+    # streamed_load_seconds is the same level forced through the streaming path, which only adds the chunks around
+    # the player (None for a level without one, those can't be streamed)
+    level = wowlvl.read_level(level_file_path)
+    timings = {}
+    for streaming in (None, True) if level.player is not None else (None,):
+        if streaming:
+            wowlvl.read_chunked(level_file_path)
+        best = float("inf")
+        for _ in range(repeats):
+            engine = Engine(None)
+            start = time.perf_counter()
+            load_level(engine, level_file_path, streaming)
+            best = min(best, time.perf_counter() - start)
+            engine.close()
+        timings[streaming] = best
+    best = timings[None]
+    entities = wowlvl.entity_count(level_file_path)    # engine.objects only has the loaded chunks of a streamed level
+    return {"level": level_file_path, "entities": entities, "load_seconds": best,
+            "entities_per_second": entities / best if best else float("inf"), "streamed_load_seconds": timings.get(True)}
+
+def bench_entity_memory(count = 10000):
+    # Python-side allocations per level entity (Entity + its pymunk shape), and the size of the bare Entity object
+    space = pymunk.Space()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    entities = [Entity(OBJECT, (i * 60.0, 0.0), (50.0, 50.0), body = space.static_body) for i in range(count)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return {"scenario": "entity_memory", "entities": len(entities), "bytes_per_entity": used / count,
+            "entity_object_bytes": sys.getsizeof(entities[0])}
+
+def bench_respawn(deaths = 10000):
+    # Dies over and over on a spike just under the spawn point; respawning must not add bodies or shapes to the space
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench_respawn.wowlvl")
+        with open(path, "w") as file:
+            file.write("player 540 360;\nspike 540 426 400 80;\n")
+        engine = Engine(None, 500)
+        load_level(engine, path)
+        os.remove(wowlvl.compiled_path(path))
+    before = (len(engine.space.bodies), len(engine.space.shapes))
+    start = time.perf_counter()
+    while engine.deaths < deaths:
+        engine.tick(InputState())
+    elapsed = time.perf_counter() - start
+    after = (len(engine.space.bodies), len(engine.space.shapes))
+    return {"scenario": "respawn", "deaths": engine.deaths, "bodies_before": before[0], "bodies_after": after[0],
+            "shapes_before": before[1], "shapes_after": after[1], "deaths_per_second": engine.deaths / elapsed}
+
+def generate_boxes(file, count, rng):
+    # scattered boxes at roughly constant density, so the area grows with the count
+    side = int(count ** 0.5 * 120) + 1080
+    file.write("player 540 360;\nobject 540 420 400 20;\n")
+    file.write(f"finish {side - 100} {side - 100} 100 100;\n")
+    for _ in range(count):
+        file.write(f"object {rng.uniform(0, side):.1f} {rng.uniform(500, side):.1f} {rng.uniform(10, 80):.1f} {rng.uniform(10, 80):.1f};\n")
+
+def generate_spikes(file, count, rng):
+    # rows of thin spikes right under the spawn point, the player keeps dying on them
+    columns = max(1, min(count, 100))
+    file.write("player 540 360;\n")
+    for i in range(count):
+        row, column = divmod(i, columns)
+        file.write(f"spike {540 + (column - columns / 2) * 20} {450 + row * 90} 10 80;\n")
+
+GENERATORS = {"boxes": generate_boxes, "spikes": generate_spikes}
+
+def generate_level(directory, kind, count, seed = 0):
+    path = os.path.join(directory, f"bench_{kind}_{count}.wowlvl")
+    with open(path, "w") as file:
+        GENERATORS[kind](file, count, random.Random(seed))
+    return path
+
+def bench_sprites(count = 10000, sizes = (10, 60), repeats = 5):
+    # Bakes the tiles of one screen with count objects of random kind and size in it, once drawing each object with its own
+    # call like the engine used to and once through the render queue (one Surface.blits out of the texture atlas); best of a few runs
+    screen = pygame.display.set_mode((1080, 720))
+    engine = Engine(screen, 500)
+    rng = random.Random(0)
+    engine.add_objects([Entity(rng.randrange(len(KIND_COLORS)), (rng.uniform(0, 1080), rng.uniform(0, 720)), (rng.randint(*sizes), rng.randint(*sizes)),
+                               body = engine.space.static_body) for _ in range(count)])
+    size = engine.tile_size
+    tiles = [(tx, ty) for ty in range(720 // size + 1) for tx in range(1080 // size + 1)]
+
+    def immediate(tx, ty):
+        tile = pygame.Surface((size, size))
+        tile.fill((0, 0, 0))
+        x, y = tx * size, ty * size
+        for obj in engine.grid.query(x, y, x + size - 1, y + size - 1):
+            left, top = obj.position[0] - obj.size[0] // 2 - x, obj.position[1] - obj.size[1] // 2 - y
+            texture_name = obj.texture_name or KIND_TEXTURES[obj.kind]
+            if texture_name and texture_name in engine.textures:
+                tile.blit(engine.texture_cache.get(texture_name, obj.size), (left, top))
+            else:
+                pygame.draw.rect(tile, KIND_COLORS[obj.kind], (left, top, obj.size[0], obj.size[1]))
+
+    result = {"scenario": f"sprites_{count}", "sprites": count, "sizes": list(sizes)}
+    for name, bake in (("immediate_ms", immediate), ("batched_ms", engine.bake_tile)):
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for tx, ty in tiles:
+                bake(tx, ty)
+            best = min(best, time.perf_counter() - start)
+        result[name] = best * 1000
+    result["sprite_speedup"] = result["immediate_ms"] / result["batched_ms"]
+    return result
+
+# (cell size, cell count) given to space.use_spatial_hash, next to pymunk's default bb-tree
+SPATIAL_HASHES = ((50, 1000), (100, 1000), (100, 10000), (200, 1000))
+
+def bench_spatial_index(count = 10000, seconds = 6, hashes = SPATIAL_HASHES):
+    # Loads a boxes level and walks right over it without jumping, so the player keeps landing on boxes, once with
+    # the tree the engine uses and once per spatial hash; steps_per_second is the tree's
+    with tempfile.TemporaryDirectory() as directory:
+        path = generate_level(directory, "boxes", count)
+        wowlvl.read_level(path)
+        result = {"scenario": f"spatial_{count}", "entities": count, "hashes": {}}
+        for index in (None,) + tuple(hashes):
+            engine = Engine(None, 500)
+            start = time.perf_counter()
+            load_level(engine, path, streaming = False)
+            if index:
+                engine.space.use_spatial_hash(*index)
+            loaded = time.perf_counter() - start
+            start = time.perf_counter()
+            engine.run_headless(seconds, lambda engine: InputState(RIGHT))
+            timing = {"load_seconds": loaded, "steps_per_second": engine.ticks / (time.perf_counter() - start)}
+            engine.close()
+            if index:
+                result["hashes"][f"{index[0]}x{index[1]}"] = timing
+            else:
+                result.update(timing)
+        remove_compiled(path)
+    result["best_hash_speedup"] = max(timing["steps_per_second"] for timing in result["hashes"].values()) / result["steps_per_second"]
+    return result
+
+def respawn_leaked(result):
+    return (result["bodies_before"], result["shapes_before"]) != (result["bodies_after"], result["shapes_after"])
+
+def remove_compiled(level_file_path):
+    # big levels are streamed, so they also have a chunked copy
+    for compiled in (wowlvl.compiled_path(level_file_path), wowlvl.chunked_path(level_file_path)):
+        if os.path.exists(compiled):
+            os.remove(compiled)
+
+def run_scenario(name, level_file_path, frames, particles_per_frame = 0, jump_every = 1):
+    screen = pygame.display.set_mode((1080, 720))
+    result = {"scenario": name}
+
+    # cold load parses the text and compiles it, warm load maps the compiled copy
+    remove_compiled(level_file_path)
+    engine = Engine(None)
+    start = time.perf_counter()
+    load_level(engine, level_file_path)
+    result["cold_load_seconds"] = time.perf_counter() - start
+    engine.close()
+    loaded = bench_load(level_file_path, repeats = 3)
+    result.update(entities = loaded["entities"], load_seconds = loaded["load_seconds"], entities_per_second = loaded["entities_per_second"],
+                  streamed_load_seconds = loaded["streamed_load_seconds"])
+
+    # jump_every is in seconds, so the player hops and lands on boxes at any tick rate instead of flying off
+    engine = Engine(screen, 500)
+    load_level(engine, level_file_path)
+    jump_ticks = max(1, round(jump_every / engine.dt)) if jump_every else 0
+    engine.draw()
+    start = time.perf_counter()
+    for frame in range(frames):
+        if particles_per_frame:
+            engine.particles.spawn(particles_per_frame, tuple(engine.player.body.position), 300, 0.5, (255, 0, 0))
+        engine.advance(engine.dt, RIGHT, JUMP if jump_ticks and frame % jump_ticks == 0 else 0)
+        engine.draw()
+        pygame.display.update(engine.update_rects)
+    result["ms_per_frame"] = (time.perf_counter() - start) / frames * 1000
+    engine.close()
+
+    engine = Engine(None, 500)
+    load_level(engine, level_file_path)
+    touching = [0]
+
+    def policy(engine):
+        # counts the ticks the player is in contact with something, so a run that only flies over the level shows up
+        arbiters = []
+        engine.player.body.each_arbiter(arbiters.append)
+        touching[0] += bool(arbiters)
+        return InputState(RIGHT, JUMP if jump_ticks and engine.ticks % jump_ticks == 0 else 0)
+
+    start = time.perf_counter()
+    engine.run_headless(frames * 4 / engine.tick_rate, policy)
+    result["steps_per_second"] = engine.ticks / (time.perf_counter() - start)
+    result["contact_fraction"] = touching[0] / engine.ticks if engine.ticks else None
+    result["deaths"] = engine.deaths
+    engine.close()
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    if resource:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result["peak_rss_mb"] = rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    else:
+        result["peak_rss_mb"] = None
+    return result
+
+def scenarios(directory, sizes):
+    # name, level, particles spawned per frame, seconds between jumps
+    for size in sizes:
+        yield f"boxes_{size}", generate_level(directory, "boxes", size), 0, 1
+    for size in sizes:
+        if size <= 10000:
+            yield f"spikes_{size}", generate_level(directory, "spikes", size), 0, 0     # no jumping, so the player keeps landing on spikes
+    yield "particle_storm", generate_level(directory, "boxes", 100), 500, 1
+
+def run_suite(sizes, frames):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, path, particles_per_frame, jump_every in scenarios(directory, sizes):
+            # every scenario gets a fresh process so peak memory isn't carried over from the previous one
+            with ProcessPoolExecutor(1, max_tasks_per_child = 1) as pool:
+                results[name] = pool.submit(run_scenario, name, path, frames, particles_per_frame, jump_every).result()
+            print(json.dumps(results[name]), file = sys.stderr)
+            remove_compiled(path)
+    results["entity_memory"] = bench_entity_memory()
+    print(json.dumps(results["entity_memory"]), file = sys.stderr)
+    results["respawn"] = bench_respawn()
+    print(json.dumps(results["respawn"]), file = sys.stderr)
+    results["sprites_10000"] = bench_sprites()
+    print(json.dumps(results["sprites_10000"]), file = sys.stderr)
+    results["spatial_10000"] = bench_spatial_index()
+    print(json.dumps(results["spatial_10000"]), file = sys.stderr)
+    results["startup"] = bench_startup()
+    print(json.dumps(results["startup"]), file = sys.stderr)
+    for screen_name in ("menu", "editor"):
+        results[f"idle_{screen_name}"] = bench_idle(screen_name)
+        print(json.dumps(results[f"idle_{screen_name}"]), file = sys.stderr)
+    return {"meta": {"python": platform.python_version(), "pygame": pygame.version.ver, "pymunk": pymunk.version,
+                     "platform": platform.platform(), "frames": frames, "date": time.strftime("%Y-%m-%d %H:%M:%S")},
+            "results": results}
+
+# Run in a fresh interpreter each time, so nothing is imported or cached yet
+STARTUP_SCRIPT = """
+import os, sys, time, json
+start = time.perf_counter()
+import twow
+imported = time.perf_counter()
+import pygame
+pygame.init()
+menu = twow.MainMenu(pygame.display.set_mode((1080, 720)))
+while twow.assets.first_frame is None:     # the first frame that shows the level list
+    menu.frame()
+print(json.dumps({"import_seconds": imported - start, "first_frame_seconds": twow.assets.first_frame}))
+"""
+
+def bench_startup(repeats = 5):
+    # time to import twow and to get the main menu's first frame on screen, best of a few fresh processes
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], capture_output = True, text = True, check = True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {"scenario": "startup", **{metric: min(run[metric] for run in runs) for metric in runs[0]}}
+
+IDLE_SCRIPT = """
+import sys, time, json
+import pygame, twow
+pygame.init()
+screen = pygame.display.set_mode((1080, 720))
+screen_name, seconds = sys.argv[1], float(sys.argv[2])
+if screen_name == "menu":
+    screen, stop = twow.MainMenu(screen), pygame.event.Event(pygame.QUIT)
+else:
+    screen, stop = twow.LevelEditor(screen), pygame.event.Event(pygame.KEYDOWN, key = pygame.K_ESCAPE)
+pygame.time.set_timer(stop, int(seconds * 1000), 1)
+wall, cpu = time.perf_counter(), time.process_time()
+try:
+    screen.run()
+except SystemExit:
+    pass
+print(json.dumps({"idle_cpu_percent": (time.process_time() - cpu) / (time.perf_counter() - wall) * 100}))
+"""
+
+def bench_idle(screen_name = "menu", seconds = 5):
+    # CPU used by the menu or the editor while nobody touches it, in percent of one core
+    output = subprocess.run([sys.executable, "-c", IDLE_SCRIPT, screen_name, str(seconds)], capture_output = True, text = True, check = True).stdout
+    return {"scenario": f"idle_{screen_name}", **json.loads(output.strip().splitlines()[-1])}
+
+def compare(baseline, current, threshold):
+    # returns (scenario, metric, baseline value, current value, relative change) for everything that got worse by more than threshold
+    regressions = []
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if not old:
+            continue
+        for metric, bigger_is_better in METRICS.items():
+            if old.get(metric) is None or result.get(metric) is None or old[metric] == 0:
+                continue
+            change = (result[metric] - old[metric]) / old[metric]
+            if (-change if bigger_is_better else change) > threshold:
+                regressions.append((name, metric, old[metric], result[metric], change))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Headless performance benchmarks")
+    commands = parser.add_subparsers(dest = "command")
+    suite = commands.add_parser("suite", help = "run the synthetic benchmark suite (default)")
+    suite.add_argument("--sizes", default = "100,1000,10000,100000", help = "comma separated object counts")
+    suite.add_argument("--frames", type = int, default = 300)
+    suite.add_argument("--save", help = "write the results to this JSON file")
+    suite.add_argument("--compare", help = "baseline JSON to compare against")
+    suite.add_argument("--threshold", type = float, default = 0.15, help = "relative slowdown that counts as a regression")
+    respawn = commands.add_parser("respawn", help = "die 10k times and check the space doesn't grow")
+    respawn.add_argument("--deaths", type = int, default = 10000)
+    load = commands.add_parser("load", help = "measure load_level throughput of existing levels")
+    load.add_argument("paths", nargs = "*")
+    startup = commands.add_parser("startup", help = "measure import time and time to the menu's first frame")
+    startup.add_argument("--repeats", type = int, default = 5)
+    idle = commands.add_parser("idle", help = "measure CPU use of the menu and the editor while idle")
+    idle.add_argument("--seconds", type = float, default = 5)
+    sprites = commands.add_parser("sprites", help = "compare per-sprite draw calls with the batched render queue")
+    sprites.add_argument("--count", type = int, default = 10000)
+    sprites.add_argument("--sizes", default = "10,60", help = "smallest and biggest sprite side in pixels")
+    spatial = commands.add_parser("spatial", help = "compare physics steps with pymunk's bb-tree and with spatial hashes")
+    spatial.add_argument("--count", type = int, default = 10000)
+    spatial.add_argument("--seconds", type = float, default = 6, help = "simulated seconds per run")
+    args = parser.parse_args(sys.argv[1:] or ["suite"])
+
+    if args.command == "respawn":
+        result = bench_respawn(args.deaths)
+        print(json.dumps(result))
+        if respawn_leaked(result):
+            print("FAIL respawning changed the number of bodies/shapes in the space", file = sys.stderr)
+            sys.exit(1)
+        sys.exit()
+
+    if args.command == "startup":
+        print(json.dumps(bench_startup(args.repeats)))
+        sys.exit()
+
+    if args.command == "sprites":
+        print(json.dumps(bench_sprites(args.count, tuple(int(side) for side in args.sizes.split(",")))))
+        sys.exit()
+
+    if args.command == "spatial":
+        print(json.dumps(bench_spatial_index(args.count, args.seconds)))
+        sys.exit()
+
+    if args.command == "idle":
+        for screen_name in ("menu", "editor"):
+            print(json.dumps(bench_idle(screen_name, args.seconds)))
+        sys.exit()
+
+    if args.command == "load":
+        paths = args.paths or [os.path.join("Levels", file) for file in sorted(os.listdir("Levels")) if file.endswith(".wowlvl")]
+        for path in paths:
+            print(json.dumps(bench_load(path)))
+        sys.exit()
+
+    current = run_suite([int(size) for size in args.sizes.split(",")], args.frames)
+    print(json.dumps(current, indent = 4))
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(current, file, indent = 4)
+    failed = respawn_leaked(current["results"]["respawn"])
+    if failed:
+        print("FAIL respawning changed the number of bodies/shapes in the space", file = sys.stderr)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file), current, args.threshold)
+        for name, metric, old, new, change in regressions:
+            print(f"REGRESSION {name} {metric}: {old:.4g} -> {new:.4g} ({change:+.0%})", file = sys.stderr)
+        failed = failed or bool(regressions)
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,295 @@
+import os
+import time
+import json
+import argparse
+import multiprocessing
+import numpy as np
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from twow import (Engine, Player, InputState, KEY_BITS, SPIKE, FINISH, CHECKPOINT, PLAYER_COLLISION_TYPE,
+                  KIND_COLLISION_TYPES, on_collision_begin, touch, start_tick, finish_tick, load_level, load_settings)
+import pygame
+import pymunk
+
+# Environments for training and evaluating bots, gym style: reset() -> (observations, infos) and
+# step(actions) -> (observations, rewards, terminated, truncated, infos). An action is a bitmask of the
+# KEY_BITS keys that are held; keys that weren't held in the previous action count as pressed.
+#
+# Observations are float32 rows of
+#   x, y, vx, vy, angle, angular velocity, dx and dy to the closest finish line,
+# followed by the nearest_objects closest level objects as (kind, dx, dy, width, height), padded with kind -1.
+PLAYER_FEATURES = 8
+OBJECT_FEATURES = 5
+ACTIONS = tuple(KEY_BITS[key] for key in (pygame.K_a, pygame.K_d, pygame.K_s, pygame.K_q, pygame.K_e, pygame.K_LCTRL, pygame.K_SPACE))
+AGENT_GROUP = 1     # every agent's shape is in this collision group, so agents don't collide with each other
+DENSE_LIMIT = 1 << 16   # agents * objects up to which nearest objects come from one distance matrix instead of the grid
+
+class Agent:
+    __slots__ = ("player", "respawn_position", "ticks", "deaths", "held", "touched", "distance")
+
+    def __init__(self, player):
+        self.player = player
+        self.touched = set()
+
+class VectorEnv:
+    # num_envs independent runs of one level, simulated together: all agents live in one pymunk space with the level
+    # added once, so the geometry is shared and one space.step advances every agent. Agents that finish, fall
+    # out of the level or run out of time are reset on the spot; their last info is in infos["final"].
+    def __init__(self, level_file_path, num_envs = 1, tick_rate = None, iterations = None, frame_skip = 4, max_time = 30,
+                 nearest_objects = 8, view_radius = 600, finish_reward = 10.0, death_penalty = -1.0):
+        settings = load_settings()
+        self.engine = Engine(None, tick_rate or settings["physics_tick_rate"], iterations = iterations or settings["solver_iterations"])
+        load_level(self.engine, level_file_path, streaming = False)     # every agent needs the whole level
+        if self.engine.player is None:
+            raise ValueError(f"{level_file_path} has no player")
+        self.spawn = self.engine.initial_player_position
+        self.num_envs = num_envs
+        self.frame_skip = frame_skip
+        self.max_ticks = int(max_time * self.engine.tick_rate)
+        self.nearest_objects = nearest_objects
+        self.view_radius = view_radius
+        self.finish_reward = finish_reward
+        self.death_penalty = death_penalty
+        self.floor = self.engine.level_bounds.bottom + 2000     # below this an agent is never coming back
+        self.finishes = np.array([obj.position for obj in self.engine.objects if obj.kind == FINISH], np.float64).reshape(-1, 2)
+        # (kind, x, y, width, height) of every object, the grid is mapped back to rows of it through object_index
+        self.object_features = np.array([(obj.kind, *obj.position, *obj.size) for obj in self.engine.objects], np.float64).reshape(-1, OBJECT_FEATURES)
+        self.object_index = {id(obj): i for i, obj in enumerate(self.engine.objects)}
+        self.observation_size = PLAYER_FEATURES + nearest_objects * OBJECT_FEATURES
+        self.observations = np.zeros((num_envs, self.observation_size), np.float32)
+        self.rewards = np.zeros(num_envs, np.float32)
+        self.terminated = np.zeros(num_envs, bool)
+        self.truncated = np.zeros(num_envs, bool)
+
+        # the level's player is the first agent, the others are extra bodies in the same space
+        players = [self.engine.player] + [Player(self.engine, self.spawn, "player") for _ in range(num_envs - 1)]
+        self.engine.space.add(*(item for player in players[1:] for item in (player.body, player.shape)))
+        self.agents = [Agent(player) for player in players]
+        self.agent_by_shape = {}
+        for agent in self.agents:
+            agent.player.shape.filter = pymunk.ShapeFilter(group = AGENT_GROUP)
+            self.agent_by_shape[agent.player.shape] = agent
+            self.reset_agent(agent)
+
+        # the engine's handlers only know about engine.player; these replace them with per-agent ones
+        for kind in (SPIKE, FINISH, CHECKPOINT):
+            on_collision_begin(self.engine.space, PLAYER_COLLISION_TYPE, KIND_COLLISION_TYPES[kind],
+                               lambda arbiter, kind = kind: touch(self.agent_by_shape[arbiter.shapes[0]], kind, arbiter, self.engine.checkpoints))
+
+    def finish_offsets(self, positions):
+        # (n, 2) positions -> (n, 2) offsets to the closest finish line and (n,) distances to it
+        if not len(self.finishes):
+            return np.zeros((len(positions), 2)), np.zeros(len(positions))
+        offsets = self.finishes[None, :, :] - positions[:, None, :]
+        distances = np.hypot(offsets[..., 0], offsets[..., 1])
+        closest = distances.argmin(axis = 1)
+        rows = np.arange(len(positions))
+        return offsets[rows, closest], distances[rows, closest]
+
+    def reset_agent(self, agent):
+        agent.player.respawn(self.spawn)
+        agent.respawn_position = self.spawn
+        agent.ticks = agent.deaths = agent.held = 0
+        agent.touched.clear()
+        agent.distance = self.finish_offsets(np.array([self.spawn]))[1][0]
+
+    def reset(self):
+        for agent in self.agents:
+            self.reset_agent(agent)
+        self.observe()
+        return self.observations.copy(), {}
+
+    def nearest(self, positions):
+        # (n, k) rows of object_features closest to each position within view_radius, -1 where there are fewer
+        k = self.nearest_objects
+        found = np.full((len(positions), k), -1)
+        if not k or not len(self.object_features):
+            return found
+        if len(positions) * len(self.object_features) <= DENSE_LIMIT:
+            candidates = np.broadcast_to(np.arange(len(self.object_features)), (len(positions), len(self.object_features)))
+        else:
+            r = self.view_radius
+            queried = [[self.object_index[id(obj)] for obj in self.engine.grid.query(x - r, y - r, x + r, y + r)] for x, y in positions.tolist()]
+            candidates = np.full((len(positions), max(map(len, queried), default = 0)), -1)
+            for row, indices in zip(candidates, queried):
+                row[:len(indices)] = indices
+        distances = ((self.object_features[candidates, 1:3] - positions[:, None, :]) ** 2).sum(axis = 2)
+        distances[(candidates < 0) | (distances > self.view_radius ** 2)] = np.inf
+        if distances.shape[1] > k:
+            closest = np.argpartition(distances, k - 1, axis = 1)[:, :k]
+        else:
+            closest = np.broadcast_to(np.arange(distances.shape[1]), (len(positions), distances.shape[1]))
+        rows = np.arange(len(positions))[:, None]
+        order = np.argsort(distances[rows, closest], axis = 1)
+        closest = closest[rows, order]
+        in_view = np.isfinite(distances[rows, closest])
+        found[:, :closest.shape[1]] = np.where(in_view, candidates[rows, closest], -1)
+        return found
+
+    def observe(self):
+        bodies = [agent.player.body for agent in self.agents]
+        state = np.array([(*body.position, *body.velocity, body.angle, body.angular_velocity) for body in bodies])
+        positions = state[:, :2]
+        offsets, _ = self.finish_offsets(positions)
+        observations = self.observations
+        observations[:, :6] = state
+        observations[:, 6:8] = offsets
+
+        found = self.nearest(positions)
+        objects = self.object_features[np.maximum(found, 0)]     # (n, k, 5)
+        objects[..., 1:3] -= positions[:, None, :]
+        objects[found < 0] = (-1, 0, 0, 0, 0)
+        observations[:, PLAYER_FEATURES:] = objects.reshape(len(bodies), -1)
+
+    def step(self, actions):
+        # actions: one held-keys bitmask per agent
+        engine = self.engine
+        self.rewards[:] = 0
+        self.terminated[:] = False
+        self.truncated[:] = False
+        results = {}
+        inputs = []
+        for agent, action in zip(self.agents, actions):
+            inputs.append(InputState.from_held(int(action), agent.held))
+            agent.held = int(action)
+
+        for skip in range(self.frame_skip):
+            # Engine.tick's rules, for every agent around one step of the shared space
+            for agent, state in zip(self.agents, inputs):
+                start_tick(agent, state)
+            engine.space.step(engine.dt)
+            for i, (agent, state) in enumerate(zip(self.agents, inputs)):
+                if i in results:
+                    continue
+                died_at, finished = finish_tick(agent, state)
+                agent.ticks += 1
+                if died_at:
+                    agent.deaths += 1
+                    self.rewards[i] += self.death_penalty
+                if finished:
+                    self.rewards[i] += self.finish_reward
+                    results[i] = "finish"
+                elif agent.player.body.position.y > self.floor:
+                    results[i] = "fell"
+                elif agent.ticks >= self.max_ticks:
+                    results[i] = "timeout"
+            if skip == 0:
+                inputs = [InputState(state.held) for state in inputs]     # keydowns only count on the first tick
+
+        final = {}
+        for i, result in results.items():
+            agent = self.agents[i]
+            self.terminated[i] = result != "timeout"
+            self.truncated[i] = result == "timeout"
+            final[i] = {"result": result, "time": round(agent.ticks * engine.dt, 2), "deaths": agent.deaths}
+        # shaped reward: getting closer to the finish, in thousands of pixels
+        distances = self.finish_offsets(np.array([tuple(agent.player.body.position) for agent in self.agents]))[1]
+        self.rewards += (np.array([agent.distance for agent in self.agents]) - distances) / 1000
+        for agent, distance in zip(self.agents, distances):
+            agent.distance = distance
+        for i in results:
+            self.reset_agent(self.agents[i])
+        self.observe()
+        return self.observations.copy(), self.rewards.copy(), self.terminated.copy(), self.truncated.copy(), {"final": final}
+
+    def close(self):
+        pass
+
+class WorldEnv:
+    # A single run of a level, the VectorEnv with one agent unpacked
+    def __init__(self, level_file_path, **kwargs):
+        self.env = VectorEnv(level_file_path, 1, **kwargs)
+        self.observation_size = self.env.observation_size
+
+    def reset(self):
+        observations, infos = self.env.reset()
+        return observations[0], infos
+
+    def step(self, action):
+        observations, rewards, terminated, truncated, infos = self.env.step([action])
+        return observations[0], float(rewards[0]), bool(terminated[0]), bool(truncated[0]), infos["final"].get(0, {})
+
+    def close(self):
+        self.env.close()
+
+def worker(connection, level_file_path, num_envs, kwargs):
+    env = VectorEnv(level_file_path, num_envs, **kwargs)
+    connection.send(env.observation_size)
+    while True:
+        command, data = connection.recv()
+        if command == "step":
+            connection.send(env.step(data))
+        elif command == "reset":
+            connection.send(env.reset())
+        else:
+            connection.close()
+            return
+
+class ProcessVectorEnv:
+    # Spreads num_envs agents over worker processes, each running a VectorEnv; step sends every worker its slice of
+    # the actions first and only then collects, so the workers simulate in parallel. The compiled level is
+    # memory-mapped, so the workers share its pages instead of each holding a copy.
+    def __init__(self, level_file_path, num_envs, workers = None, **kwargs):
+        workers = min(workers or os.cpu_count(), num_envs)
+        self.num_envs = num_envs
+        self.splits = np.array_split(np.arange(num_envs), workers)
+        context = multiprocessing.get_context("spawn")     # pygame and pymunk state doesn't survive a fork well
+        self.connections = []
+        self.processes = []
+        for indices in self.splits:
+            parent, child = context.Pipe()
+            process = context.Process(target = worker, args = (child, level_file_path, len(indices), kwargs), daemon = True)
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+        self.observation_size = [connection.recv() for connection in self.connections][0]
+
+    def reset(self):
+        for connection in self.connections:
+            connection.send(("reset", None))
+        return np.concatenate([connection.recv()[0] for connection in self.connections]), {}
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        for connection, indices in zip(self.connections, self.splits):
+            connection.send(("step", actions[indices]))
+        results = [connection.recv() for connection in self.connections]
+        final = {}
+        for indices, result in zip(self.splits, results):
+            final.update({int(indices[i]): info for i, info in result[4]["final"].items()})
+        return (*(np.concatenate([result[field] for result in results]) for field in range(4)), {"final": final})
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close", None))
+        for process in self.processes:
+            process.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Measure environment throughput with random actions")
+    parser.add_argument("level")
+    parser.add_argument("--envs", type = int, default = 64, help = "number of agents")
+    parser.add_argument("--workers", type = int, default = 0, help = "worker processes, 0 runs everything in this process")
+    parser.add_argument("--steps", type = int, default = 500, help = "env steps per agent")
+    parser.add_argument("--frame-skip", type = int, default = 4)
+    args = parser.parse_args()
+
+    if args.workers:
+        env = ProcessVectorEnv(args.level, args.envs, args.workers, frame_skip = args.frame_skip)
+    else:
+        env = VectorEnv(args.level, args.envs, frame_skip = args.frame_skip)
+    rng = np.random.default_rng(0)
+    env.reset()
+    episodes = []
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        _, _, _, _, infos = env.step(rng.choice(np.array(ACTIONS + (0,)), args.envs))
+        episodes += infos["final"].values()
+    elapsed = time.perf_counter() - start
+    env.close()
+    ticks = args.steps * args.envs * args.frame_skip
+    print(json.dumps({"envs": args.envs, "workers": args.workers, "env_steps_per_second": round(args.steps * args.envs / elapsed),
+                      "ticks_per_second": round(ticks / elapsed), "episodes": len(episodes),
+                      "finished": sum(episode["result"] == "finish" for episode in episodes)}))
@@ -0,0 +1,180 @@
+import os
+import json
+import queue
+import threading
+from collections import OrderedDict
+import numpy as np
+import wowlvl
+
+INDEX_PATH = "Data/level_index.json"
+PLAYER_COLOR = (0, 0, 255)
+PLACEHOLDER_COLOR = (40, 40, 40)
+
+class LevelInfo:
+    __slots__ = ("name", "path", "mtime", "size", "entities", "bounds")
+
+    def __init__(self, name, path, mtime, size, entities, bounds):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.entities = entities    # kind name -> count
+        self.bounds = bounds        # (left, top, right, bottom) of everything in the level
+
+    def to_json(self):
+        return {"mtime": self.mtime, "size": self.size, "entities": self.entities, "bounds": self.bounds}
+
+def describe_level(name, path, stat):
+    level = wowlvl.read_level(path)
+    boxes = [records for records in level.entities.values() if len(records)]
+    if level.player is not None:
+        x, y = level.player
+        boxes.append(np.array([[x, y, 50, 50]], np.float32))
+    if boxes:
+        records = np.concatenate(boxes)
+        half = records[:, 2:] / 2
+        bounds = [*(records[:, :2] - half).min(axis = 0).tolist(), *(records[:, :2] + half).max(axis = 0).tolist()]
+    else:
+        bounds = [0, 0, 0, 0]
+    return LevelInfo(name, path, stat.st_mtime_ns, stat.st_size,
+                     {kind: len(records) for kind, records in level.entities.items()}, bounds)
+
+def rasterize(level, bounds, size, colors):
+    # Draws a level as an RGB array of shape (width, height, 3), kinds in order with the player on top. Every kind is
+    # painted at once: its rectangles' corners are counted into an edge array whose 2D prefix sum is the number of
+    # rectangles covering each pixel, so a million entities cost a few array operations instead of a draw call each.
+    width, height = size
+    left, top, right, bottom = bounds
+    scale = min(width / max(right - left, 1), height / max(bottom - top, 1))
+    layers = [(level.entities[kind], color) for kind, color in zip(wowlvl.KINDS, colors)]
+    if level.player is not None:
+        layers.append((np.array([[*level.player, 50, 50]], np.float32), PLAYER_COLOR))
+    pixels = np.zeros((width, height, 3), np.uint8)
+    stride = height + 1
+    for records, color in layers:
+        if not len(records):
+            continue
+        x0 = ((records[:, 0] - records[:, 2] / 2 - left) * scale).astype(np.int64)
+        y0 = ((records[:, 1] - records[:, 3] / 2 - top) * scale).astype(np.int64)
+        x1 = np.clip(x0 + np.maximum((records[:, 2] * scale).astype(np.int64), 1), 0, width)
+        y1 = np.clip(y0 + np.maximum((records[:, 3] * scale).astype(np.int64), 1), 0, height)
+        x0, y0 = np.clip(x0, 0, width), np.clip(y0, 0, height)
+        corners = (width + 1) * stride
+        edges = (np.bincount(x0 * stride + y0, minlength = corners) - np.bincount(x1 * stride + y0, minlength = corners)
+                 - np.bincount(x0 * stride + y1, minlength = corners) + np.bincount(x1 * stride + y1, minlength = corners))
+        covered = edges.reshape(width + 1, stride).cumsum(axis = 0).cumsum(axis = 1)[:width, :height] > 0
+        pixels[covered] = color
+    return pixels
+
+def render_thumbnails(requests, rendered, size):
+    # worker thread; it only holds the queue and the results, so the library can go away while it waits
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        key, path, bounds, colors = request
+        try:
+            rendered[key] = rasterize(wowlvl.read_level(path), bounds, size, colors)
+        except (OSError, ValueError, IndexError) as e:
+            print(f"can't draw a thumbnail of {path}: {e}")
+            rendered[key] = np.zeros((*size, 3), np.uint8)
+
+class LevelLibrary:
+    # Keeps metadata of every level in a directory. The index file from the last scan is loaded right away, so the
+    # menu has something to show instantly; scan_async then refreshes it in a background thread, only re-reading
+    # levels whose mtime or size changed. Readers get a consistent list because scans swap in a new one.
+    def __init__(self, directory = "Levels", index_path = INDEX_PATH, thumbnail_size = (64, 40), max_thumbnails = 256):
+        self.directory = directory
+        self.index_path = index_path
+        self.thumbnail_size = thumbnail_size
+        self.max_thumbnails = max_thumbnails
+        self.levels: list[LevelInfo] = []
+        self.version = 0        # bumped whenever levels changes
+        self.scanning = None
+        self.thumbnails = OrderedDict()
+        self.thumbnail_requests = queue.Queue()
+        self.rendered = {}          # key -> pixels from the thumbnail thread, not turned into surfaces yet
+        self.pending = set()
+        self.placeholder = None
+        self.drawing = None
+        self.load_index()
+
+    def load_index(self):
+        try:
+            with open(self.index_path, "r") as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return
+        self.levels = [LevelInfo(name, os.path.join(self.directory, name + ".wowlvl"), entry["mtime"], entry["size"], entry["entities"], entry["bounds"])
+                       for name, entry in sorted(index.items())]
+        self.version += 1
+
+    def save_index(self, levels):
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok = True)
+        with open(self.index_path + ".tmp", "w") as file:
+            json.dump({level.name: level.to_json() for level in levels}, file)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def scan(self):
+        known = {level.name: level for level in self.levels}
+        levels = []
+        changed = False
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".wowlvl"):
+                    continue
+                name = entry.name[:-7]
+                stat = entry.stat()
+                level = known.get(name)
+                if level is None or level.mtime != stat.st_mtime_ns or level.size != stat.st_size:
+                    try:
+                        level = describe_level(name, entry.path, stat)
+                    except (ValueError, IndexError) as e:
+                        print(f"skipping broken level {entry.name}: {e}")
+                        continue
+                    changed = True
+                levels.append(level)
+        levels.sort(key = lambda level: level.name)
+        if changed or len(levels) != len(self.levels):
+            self.levels = levels
+            self.version += 1
+            self.save_index(levels)
+
+    def scan_async(self):
+        if self.scanning is None or not self.scanning.is_alive():
+            self.scanning = threading.Thread(target = self.scan, daemon = True)
+            self.scanning.start()
+
+    def thumbnail(self, level: LevelInfo, colors):
+        # Small preview of the level. The first time a row showing it becomes visible a placeholder comes back and the
+        # preview is drawn in a background thread; collect_thumbnails tells the menu when to ask again.
+        import pygame
+        key = (level.name, level.mtime)     # a changed level just misses the cache
+        surface = self.thumbnails.get(key)
+        if surface is not None:
+            self.thumbnails.move_to_end(key)
+            return surface
+
+        if key not in self.pending:
+            self.pending.add(key)
+            self.thumbnail_requests.put((key, level.path, level.bounds, colors))
+            if self.drawing is None:
+                self.drawing = threading.Thread(target = render_thumbnails, args = (self.thumbnail_requests, self.rendered, self.thumbnail_size), daemon = True)
+                self.drawing.start()
+        if self.placeholder is None:
+            self.placeholder = pygame.Surface(self.thumbnail_size)
+            self.placeholder.fill(PLACEHOLDER_COLOR)
+        return self.placeholder
+
+    def collect_thumbnails(self):
+        # turns finished previews into surfaces (on the calling thread, pygame surfaces aren't made in the worker);
+        # returns whether there were any
+        import pygame
+        if not self.rendered:
+            return False
+        for key in list(self.rendered):
+            self.thumbnails[key] = pygame.surfarray.make_surface(self.rendered.pop(key))
+            self.pending.discard(key)
+        while len(self.thumbnails) > self.max_thumbnails:
+            self.thumbnails.popitem(last = False)
+        return True
@@ -0,0 +1,64 @@
+import csv
+import json
+import time
+import numpy as np
+
+# Phases of Engine.run, in the order they happen in a frame
+PHASES = ("events", "step", "player", "collisions", "particles", "objects", "sprites", "hud", "display")
+
+class FrameProfiler:
+    # Per-phase frame timings in a ring buffer. Code calls lap(phase) when it finishes a phase, which charges
+    # the time since the previous lap to it, so phases that run several times a frame (ticks) add up.
+    def __init__(self, phases = PHASES, size = 1000):
+        self.phases = phases
+        self.index = {phase: i for i, phase in enumerate(phases)}
+        self.size = size
+        self.samples = np.zeros((size, len(phases) + 1))     # seconds, last column is the whole frame
+        self.frames = 0
+        self.current = [0.0] * len(phases)
+        self.frame_start = self.mark = time.perf_counter()
+
+    def start_frame(self):
+        self.current = [0.0] * len(self.phases)
+        self.frame_start = self.mark = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.current[self.index[phase]] += now - self.mark
+        self.mark = now
+
+    def end_frame(self):
+        row = self.samples[self.frames % self.size]
+        row[:-1] = self.current
+        row[-1] = time.perf_counter() - self.frame_start
+        self.frames += 1
+
+    def history(self):
+        # recorded frames, oldest first
+        if self.frames <= self.size:
+            return self.samples[:self.frames]
+        return np.roll(self.samples, -(self.frames % self.size), axis = 0)
+
+    def percentiles(self, q = (50, 95, 99)):
+        # phase -> list of milliseconds, one per requested percentile
+        history = self.history()
+        if not len(history):
+            return {}
+        values = np.percentile(history, q, axis = 0) * 1000
+        return {phase: values[:, i].tolist() for i, phase in enumerate((*self.phases, "frame"))}
+
+    def dump(self, path):
+        history = self.history() * 1000
+        columns = [*self.phases, "frame"]
+        first = self.frames - len(history)
+        if path.endswith(".json"):
+            with open(path, "w") as file:
+                json.dump({"unit": "ms", "percentiles": self.percentiles(),
+                           "frames": [{"frame": first + i, **dict(zip(columns, row))} for i, row in enumerate(history.tolist())]}, file)
+        else:
+            with open(path, "w", newline = "") as file:
+                writer = csv.writer(file)
+                writer.writerow(["frame", *(f"{column}_ms" for column in columns)])
+                for i, row in enumerate(history.tolist()):
+                    writer.writerow([first + i, *(f"{value:.4f}" for value in row)])
+        return path
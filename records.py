@@ -0,0 +1,83 @@
+import os
+import json
+import sqlite3
+import time
+
+DB_PATH = "Data/records.sqlite3"
+LEGACY_PATH = "Data/level_records.json"
+
+class RecordStore:
+    # Best times and every finished run, in SQLite. Writes run in BEGIN IMMEDIATE transactions, so several game
+    # instances can share the file: a second writer waits on the database lock (up to timeout) instead of
+    # overwriting the other's update, and a crash mid-write leaves the previous state intact.
+    def __init__(self, path = DB_PATH, legacy_path = LEGACY_PATH, timeout = 30):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+        self.connection = sqlite3.connect(path, timeout = timeout, isolation_level = None)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, level TEXT NOT NULL, time REAL NOT NULL, finished_at TEXT, replay TEXT);
+            CREATE INDEX IF NOT EXISTS runs_level ON runs (level, time);
+            CREATE TABLE IF NOT EXISTS best (level TEXT PRIMARY KEY, time REAL NOT NULL, run_id INTEGER REFERENCES runs (id));
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        with self.transaction():
+            self.migrate(legacy_path)
+
+    def transaction(self):
+        return Transaction(self.connection)
+
+    def migrate(self, legacy_path):
+        # imports the old level_records.json once; the file itself is left alone
+        if self.connection.execute("SELECT 1 FROM meta WHERE key = 'migrated_json'").fetchone() or not os.path.exists(legacy_path):
+            return
+        with open(legacy_path, "r") as file:
+            legacy = json.loads(file.read())
+        self.insert_runs([(level, record, None, None) for level, record in legacy.items() if record != "None"])
+        self.connection.execute("INSERT INTO meta VALUES ('migrated_json', ?)", (legacy_path,))
+
+    def insert_runs(self, runs):
+        # runs: (level, time, finished_at, replay); returns how many of them became the level's best time
+        records = 0
+        for level, run_time, finished_at, replay in runs:
+            run_id = self.connection.execute("INSERT INTO runs (level, time, finished_at, replay) VALUES (?, ?, ?, ?)",
+                                             (level, run_time, finished_at, replay)).lastrowid
+            records += self.connection.execute("""INSERT INTO best VALUES (?, ?, ?)
+                                                  ON CONFLICT (level) DO UPDATE SET time = excluded.time, run_id = excluded.run_id
+                                                  WHERE excluded.time < best.time""", (level, run_time, run_id)).rowcount
+        return records
+
+    def add_run(self, level, run_time, replay = None):
+        # returns True if the run is the new best time of the level
+        return self.add_runs([(level, run_time, replay)]) > 0
+
+    def add_runs(self, runs):
+        # (level, time, replay) tuples, written in one transaction
+        finished_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self.transaction():
+            return self.insert_runs([(level, run_time, finished_at, replay) for level, run_time, replay in runs])
+
+    def best_times(self):
+        return dict(self.connection.execute("SELECT level, time FROM best"))
+
+    def best_time(self, level):
+        row = self.connection.execute("SELECT time FROM best WHERE level = ?", (level,)).fetchone()
+        return row[0] if row else None
+
+    def history(self, level, limit = 100):
+        # most recent runs first, as (time, finished_at, replay)
+        return self.connection.execute("SELECT time, finished_at, replay FROM runs WHERE level = ? ORDER BY id DESC LIMIT ?",
+                                       (level, limit)).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+class Transaction:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
@@ -0,0 +1,202 @@
+import sys
+import struct
+import hashlib
+import bisect
+
+# .wowrep layout: header, then run-length encoded input records until EOF.
+# Each record is (held bitmask, pressed bitmask, tick count), so holding a key for
+# a whole second costs 4 bytes and the file can be written while the run is going on.
+MAGIC = b"WOWREP"
+VERSION = 2
+HEADER = struct.Struct("<6sBH20sH")    # magic, version, tick rate, sha1 of the level file, solver iterations
+HEADER_V1 = struct.Struct("<6sBH20s")  # version 1 had no iterations, those runs used pymunk's default of 10
+RECORD = struct.Struct("<BBH")
+MAX_RUN = 0xFFFF
+
+def level_hash(level_file_path):
+    with open(level_file_path, "rb") as file:
+        return hashlib.sha1(file.read()).digest()
+
+class ReplayRecorder:
+    def __init__(self, path, tick_rate, level_digest, iterations = 10):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, tick_rate, level_digest, iterations))
+        self.current = None
+        self.count = 0
+        self.ticks = 0
+
+    def record(self, inputs):
+        key = (inputs.held, inputs.pressed)
+        if key == self.current and self.count < MAX_RUN:
+            self.count += 1
+        else:
+            self.flush()
+            self.current, self.count = key, 1
+        self.ticks += 1
+
+    def flush(self):
+        if self.current is not None and self.count:
+            self.file.write(RECORD.pack(*self.current, self.count))
+            self.count = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+class Replay:
+    def __init__(self, tick_rate, level_digest, runs, iterations = 10):
+        self.tick_rate = tick_rate
+        self.level_digest = level_digest
+        self.iterations = iterations
+        self.runs = runs    # list of (held, pressed, count)
+        # first tick of every run, so any tick can be looked up with a bisect
+        self.starts = []
+        total = 0
+        for _, _, count in runs:
+            self.starts.append(total)
+            total += count
+        self.ticks = total
+
+    def __len__(self):
+        return self.ticks
+
+    def input_at(self, tick):
+        held, pressed, _ = self.runs[bisect.bisect_right(self.starts, tick) - 1]
+        return held, pressed
+
+    def inputs(self, start = 0):
+        from twow import InputState
+        if start >= self.ticks:
+            return
+        index = bisect.bisect_right(self.starts, start) - 1
+        offset = start - self.starts[index]
+        for held, pressed, count in self.runs[index:]:
+            for _ in range(count - offset):
+                yield InputState(held, pressed)
+            offset = 0
+
+def read_replay(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    magic, version, tick_rate, digest = HEADER_V1.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a replay file")
+    if version == 1:
+        header, iterations = HEADER_V1, 10
+    elif version == VERSION:
+        header, iterations = HEADER, HEADER.unpack_from(data)[4]
+    else:
+        raise ValueError(f"{path} has unsupported replay version {version}")
+    body = data[header.size:]
+    body = body[:len(body) - len(body) % RECORD.size]   # a run that crashed mid-write can leave a partial record
+    return Replay(tick_rate, digest, list(RECORD.iter_unpack(body)), iterations)
+
+class Replayer:
+    def __init__(self, engine, replay: Replay, snapshot_interval = 1000):
+        self.engine = engine
+        self.replay = replay
+        self.snapshot_interval = snapshot_interval
+        self.snapshots = {}
+        self.take_snapshot()
+
+    def take_snapshot(self):
+        self.snapshots[self.engine.ticks] = self.engine.snapshot()
+
+    def restore_snapshot(self, tick):
+        self.engine.restore(self.snapshots[tick])
+
+    @property
+    def done(self):
+        return self.engine.ticks >= len(self.replay) or self.engine.quit_type is not None
+
+    def step(self, ticks = 1):
+        from twow import InputState
+        for _ in range(ticks):
+            if self.done:
+                break
+            self.engine.tick(InputState(*self.replay.input_at(self.engine.ticks)))
+            if self.engine.ticks % self.snapshot_interval == 0 and self.engine.ticks not in self.snapshots:
+                self.take_snapshot()
+
+    def seek(self, tick):
+        # Jump to the closest snapshot at or before the target and re-simulate only the remainder.
+        # Snapshots hold the whole space, so this ends up in the same state as playing from tick 0.
+        tick = max(0, min(tick, len(self.replay)))
+        if tick < self.engine.ticks or tick - self.engine.ticks > self.snapshot_interval:
+            known = [t for t in self.snapshots if t <= tick]
+            best = max(known)
+            if tick < self.engine.ticks or best > self.engine.ticks:
+                self.restore_snapshot(best)
+        self.step(tick - self.engine.ticks)
+
+    def run(self, speed = 1.0):
+        # Plays the replay in the engine's window. Left/right seek 5 seconds, up/down change speed.
+        import pygame
+        while True:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    pygame.quit()
+                    sys.exit()
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_ESCAPE:
+                        return
+                    if event.key == pygame.K_RIGHT:
+                        self.seek(self.engine.ticks + 5 * self.replay.tick_rate)
+                    if event.key == pygame.K_LEFT:
+                        self.seek(self.engine.ticks - 5 * self.replay.tick_rate)
+                    if event.key == pygame.K_UP:
+                        speed *= 2
+                    if event.key == pygame.K_DOWN:
+                        speed /= 2
+
+            self.engine.accumulator += self.engine.clock.get_time() / 1000 * speed
+            ticks = int(self.engine.accumulator / self.engine.dt)
+            self.engine.accumulator -= ticks * self.engine.dt
+            self.step(ticks)
+
+            self.engine.draw()
+            pygame.display.flip()
+            self.engine.clock.tick(self.engine.fps)
+
+def verify_replay(level_file_path, replay_path):
+    # Re-simulates a replay headlessly from tick 0; returns (quit_type, time) of the run
+    from twow import Engine, load_level
+    replay = read_replay(replay_path)
+    if replay.level_digest != level_hash(level_file_path):
+        raise ValueError(f"{replay_path} was recorded on a different version of {level_file_path}")
+    engine = Engine(None, replay.tick_rate, iterations = replay.iterations)
+    try:
+        load_level(engine, level_file_path)
+        for inputs in replay.inputs():
+            engine.tick(inputs)
+            if engine.quit_type is not None:
+                break
+    finally:
+        engine.close()
+    return engine.quit_type, round(engine.time, 2)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = "Verify or watch a recorded .wowrep run")
+    parser.add_argument("command", choices = ["verify", "play"])
+    parser.add_argument("level")
+    parser.add_argument("replay")
+    args = parser.parse_args()
+
+    if args.command == "verify":
+        quit_type, time = verify_replay(args.level, args.replay)
+        print(f"{quit_type} | time: {time}")
+    else:
+        import pygame
+        from twow import Engine, load_level, load_settings
+        replay = read_replay(args.replay)
+        settings = load_settings()
+        engine = Engine(pygame.display.set_mode((1080, 720)), settings["fps"], tick_rate = replay.tick_rate,
+                        iterations = replay.iterations, interpolate = settings["interpolate"])
+        try:
+            load_level(engine, args.level)
+            Replayer(engine, replay).run()
+        finally:
+            engine.close()
@@ -0,0 +1,83 @@
+import queue
+import weakref
+import threading
+import wowlvl
+
+def prefetch(level, requests, ready):
+    # the stream's worker thread; it doesn't hold the stream itself, so a stream (and its engine) can't be kept alive by it
+    while True:
+        key = requests.get()
+        if key is None:
+            return
+        # copying out of the mapping is what actually reads the file
+        ready[key] = level.chunk(key).tolist()
+
+class LevelStream:
+    # Keeps only the chunks around the player in the engine's space. A chunk is added on the tick the player comes within
+    # radius chunks of it and removed once it's more than radius + 1 away, so crossing a chunk border back and forth
+    # doesn't reload anything. A background thread reads the chunks one ring further out ahead of time; adding them is
+    # still done by the tick that needs them, so what's in the space only depends on where the player has been and
+    # replays re-simulate the same way however fast the disk was. close() stops the thread.
+    def __init__(self, engine, level: wowlvl.ChunkedLevel, radius = 1):
+        self.engine = engine
+        self.level = level
+        self.radius = radius
+        self.loaded = {}        # chunk -> entities in the space
+        self.ready = {}         # chunk -> rows read by the prefetch thread, not added yet
+        self.requested = set()
+        self.center = None
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target = prefetch, args = (level, self.requests, self.ready), daemon = True)
+        self.thread.start()
+        weakref.finalize(self, self.requests.put, None)    # a stream nobody closed still stops its thread once it's freed
+        self.add_chunk(wowlvl.GLOBAL_CHUNK)
+
+    def chunk_at(self, x, y):
+        return int(x // self.level.chunk_size), int(y // self.level.chunk_size)
+
+    def add_chunk(self, key):
+        from twow import Entity
+        self.requested.discard(key)
+        rows = self.ready.pop(key, None)
+        if rows is None:
+            rows = self.level.chunk(key).tolist()
+        static_body = self.engine.space.static_body
+        entities = [Entity(int(kind), (x, y), (width, height), body = static_body) for kind, x, y, width, height in rows]
+        self.loaded[key] = entities
+        if entities:
+            self.engine.add_objects(entities, [row[1:] for row in rows])
+
+    def remove_chunk(self, key):
+        entities = self.loaded.pop(key)
+        if entities:
+            self.engine.remove_objects(entities)
+
+    def update(self):
+        # cheap unless the player moved to another chunk
+        center = self.chunk_at(*self.engine.player.body.position)
+        if center == self.center:
+            return
+        self.center = center
+        cx, cy = center
+        for key in [key for key in self.loaded if key != wowlvl.GLOBAL_CHUNK and max(abs(key[0] - cx), abs(key[1] - cy)) > self.radius + 1]:
+            self.remove_chunk(key)
+        for key in [key for key in list(self.ready) if max(abs(key[0] - cx), abs(key[1] - cy)) > self.radius + 2]:
+            self.ready.pop(key, None)
+            self.requested.discard(key)
+
+        reach = self.radius + 1
+        for x in range(cx - reach, cx + reach + 1):
+            for y in range(cy - reach, cy + reach + 1):
+                key = (x, y)
+                if key in self.loaded or key not in self.level.chunks:
+                    continue
+                if max(abs(x - cx), abs(y - cy)) <= self.radius:
+                    self.add_chunk(key)
+                elif key not in self.requested:
+                    self.requested.add(key)
+                    self.requests.put(key)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.requests.put(None)
+            self.thread.join()
@@ -1,77 +1,514 @@
+from assets import assets, load_settings, DEFAULT_SETTINGS
 import os
 import pygame
 import pymunk
 import pymunk.pygame_util
 import math
 import random
-import json
 import sys
+import time
+import numpy as np
+from collections import OrderedDict
 from GUI import *
+from replay import ReplayRecorder, level_hash
+import wowlvl
+from profiler import FrameProfiler
+from library import LevelLibrary, LevelInfo
+from records import RecordStore
+from streaming import LevelStream
 
-pygame.init()
-
-class Particle:
-    def __init__(self, engine, position, velocity, lifespan, color):
-        self.x, self.y = position
-        self.vx, self.vy = velocity
-        self.lifespan = lifespan
-        self.color = color
+class ParticleSystem:
+    # Fixed-capacity pool of particles stored as parallel arrays, so updating and culling is a few array operations
+    # instead of one Python object per particle. When the pool is full the oldest particles get reused.
+    def __init__(self, engine, capacity = 4096):
         self.engine = engine
-        self.texture = pygame.Surface((10, 10))
-        self.texture.fill(color)
-        self.timer = 0
-        self.dead = False
-        pygame.draw.rect(self.texture, (0, 0, 0), (0, 0, 10, 10), 1)
+        self.capacity = capacity
+        self.position = np.zeros((capacity, 2), np.float32)
+        self.velocity = np.zeros((capacity, 2), np.float32)
+        self.age = np.zeros(capacity, np.float32)
+        self.lifespan = np.zeros(capacity, np.float32)
+        self.color_index = np.zeros(capacity, np.int16)
+        self.alive = np.zeros(capacity, bool)
+        self.colors: list[tuple] = []   # color index -> color, each color gets one shared sprite
+        self.rng = np.random.default_rng()
 
-    def update(self):
-        self.x += self.vx * self.engine.dt
-        self.y += self.vy * self.engine.dt
-        self.timer += self.engine.dt
-        if self.timer >= self.lifespan:
-            self.dead = True
+    def __len__(self):
+        return int(np.count_nonzero(self.alive))
 
-    def draw(self):
-        self.engine.screen.blit(self.texture, (self.x - 5, self.y - 5))
+    def spawn(self, count, position, speed, lifespan, color):
+        if color not in self.colors:
+            self.colors.append(color)
+        count = min(count, self.capacity)
+        slots = np.flatnonzero(~self.alive)[:count]
+        if len(slots) < count:
+            # only live particles are ranked; dead ones keep their old age and are already in slots
+            oldest = np.argpartition(np.where(self.alive, -self.age, np.inf), count - len(slots) - 1)[:count - len(slots)]
+            slots = np.concatenate((slots, oldest))
+        self.position[slots] = position
+        self.velocity[slots] = self.rng.integers(-speed, speed, (len(slots), 2), endpoint = True)
+        self.age[slots] = 0
+        self.lifespan[slots] = lifespan
+        self.color_index[slots] = self.colors.index(color)
+        self.alive[slots] = True
+
+    def update(self, dt):
+        alive = self.alive
+        if not alive.any():
+            return
+        self.position[alive] += self.velocity[alive] * dt
+        self.age[alive] += dt
+        self.alive &= self.age < self.lifespan
+
+    def draw(self, queue):
+        camera = self.engine.camera
+        for index, color in enumerate(self.colors):
+            mask = self.alive & (self.color_index == index)
+            if not mask.any():
+                continue
+            corners = self.position[mask] - (5 + camera.x, 5 + camera.y)
+            queue.sprites(("particle", color), (10, 10), corners.tolist())
+
+    def clear(self):
+        self.alive[:] = False
+
+class TextureCache:
+    # Scaled / rotated copies of textures, keyed by (name, size, rotation bucket) and evicted least recently used first.
+    # A name is either a key of the engine's textures, ("solid", color) or ("particle", color).
+    def __init__(self, textures, max_bytes = 64 * 1024 * 1024, rotation_step = 2):
+        self.textures = textures
+        self.max_bytes = max_bytes
+        self.rotation_step = rotation_step
+        self.surfaces = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def bucket(self, angle):
+        return round(angle / self.rotation_step) % (360 // self.rotation_step)
+
+    def get(self, name, size, angle = 0):
+        key = (name, (int(size[0]), int(size[1])), self.bucket(angle))
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = self.make(name, key[1])
+        if key[2]:
+            surface = pygame.transform.rotate(surface, key[2] * self.rotation_step)
+        self.surfaces[key] = surface
+        self.bytes += surface.get_width() * surface.get_height() * surface.get_bytesize()
+        while self.bytes > self.max_bytes and len(self.surfaces) > 1:
+            _, evicted = self.surfaces.popitem(last = False)
+            self.bytes -= evicted.get_width() * evicted.get_height() * evicted.get_bytesize()
+        return surface
+
+    def make(self, name, size):
+        if isinstance(name, str):
+            return pygame.transform.scale(self.textures[name], size)
+        kind, color = name
+        surface = pygame.Surface(size, pygame.SRCALPHA if kind == "solid" else 0)
+        surface.fill(color)
+        if kind == "particle":
+            pygame.draw.rect(surface, (0, 0, 0), (0, 0, *size), 1)
+        return surface
+
+    def invalidate(self, name):
+        for key in [key for key in self.surfaces if key[0] == name]:
+            surface = self.surfaces.pop(key)
+            self.bytes -= surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+class TextureAtlas:
+    # Packs small sprites into a few big page surfaces (shelf packing), so a frame's sprites come out of a handful of
+    # surfaces and can be drawn with one Surface.blits. Solid colors get one block each that any rectangle up to
+    # solid_size is cut out of. Opaque and per-pixel-alpha sprites go on separate pages so opaque ones stay plain copies.
+    def __init__(self, texture_cache: TextureCache, page_size = 1024, max_pages = 4, solid_size = 256):
+        self.texture_cache = texture_cache
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.solid_size = solid_size
+        self.pages = []             # [surface, alpha, shelves], shelves are [y, height, next x]
+        self.regions = {}           # (name, size) -> (page surface, area), None if it didn't fit
+        self.solids = {}            # color -> (page surface, area of its block)
+
+    def pack(self, surface: pygame.Surface):
+        width, height = surface.get_size()
+        alpha = bool(surface.get_flags() & pygame.SRCALPHA)
+        for page in self.pages:
+            if page[1] != alpha:
+                continue
+            shelves = page[2]
+            for shelf in shelves:
+                if shelf[1] >= height and shelf[2] + width <= self.page_size:
+                    area = pygame.Rect(shelf[2], shelf[0], width, height)
+                    shelf[2] += width
+                    page[0].blit(surface, area)
+                    return page[0], area
+            top = shelves[-1][0] + shelves[-1][1] if shelves else 0
+            if top + height <= self.page_size and width <= self.page_size:
+                shelves.append([top, height, width])
+                page[0].blit(surface, (0, top))
+                return page[0], pygame.Rect(0, top, width, height)
+        if len(self.pages) >= self.max_pages or width > self.page_size or height > self.page_size:
+            return None
+        page = pygame.Surface((self.page_size, self.page_size), pygame.SRCALPHA if alpha else 0)
+        if pygame.display.get_surface() is not None:
+            page = page.convert_alpha() if alpha else page.convert()
+        self.pages.append([page, alpha, []])
+        return self.pack(surface)
+
+    def region(self, name, size):
+        # (surface, area) to blit the sprite from; falls back to the texture cache once the atlas is full
+        key = (name, (int(size[0]), int(size[1])))
+        if key not in self.regions:
+            self.regions[key] = self.pack(self.texture_cache.make(name, key[1]))
+        return self.regions[key] or (self.texture_cache.get(name, size), None)
+
+    def solid(self, color):
+        block = self.solids.get(color)
+        if block is None:
+            surface = pygame.Surface((self.solid_size, self.solid_size))
+            surface.fill(color)
+            block = self.solids[color] = self.pack(surface) or (surface, surface.get_rect())
+        return block
+
+class RenderQueue:
+    # Draw commands collected during a frame and handed to pygame in one Surface.blits call, instead of one
+    # interpreted blit/draw.rect call per sprite. Commands are drawn in the order they were queued.
+    def __init__(self, atlas: TextureAtlas, bounds: pygame.Rect = None):
+        self.atlas = atlas
+        self.bounds = bounds        # if given, rectangles are clipped to it before being queued
+        self.commands = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def blit(self, surface, dest, area = None):
+        self.commands.append((surface, dest, area) if area else (surface, dest))
+
+    def sprites(self, name, size, positions):
+        surface, area = self.atlas.region(name, size)
+        if area:
+            self.commands += [(surface, position, area) for position in positions]
+        else:
+            self.commands += [(surface, position) for position in positions]
+
+    def rect(self, color, rect):
+        # a filled rectangle, cut out of the atlas' block of that color (in pieces if it's bigger than the block)
+        surface, block = self.atlas.solid(color)
+        step = self.atlas.solid_size
+        if rect[2] <= step and rect[3] <= step:
+            self.commands.append((surface, (rect[0], rect[1]), (block.x, block.y, rect[2], rect[3])))
+            return
+        rect = pygame.Rect(rect)
+        if self.bounds is not None:
+            rect = rect.clip(self.bounds)
+        for x in range(rect.left, rect.right, step):
+            for y in range(rect.top, rect.bottom, step):
+                self.commands.append((surface, (x, y), (block.x, block.y, min(step, rect.right - x), min(step, rect.bottom - y))))
+
+    def flush(self, target: pygame.Surface, doreturn = True):
+        # returns the rectangles that were drawn, one per command, if doreturn
+        commands, self.commands = self.commands, []
+        return target.blits(commands, doreturn)
+
+# Entity kinds are small ints indexing the per-kind tables below (same order as the level file format)
+OBJECT, SPIKE, FINISH, CHECKPOINT = range(4)
+KIND_NAMES = wowlvl.KINDS
+KIND_COLORS = ((100, 100, 100), (255, 0, 0), (0, 255, 0), (255, 200, 0))
+KIND_TEXTURES = (None, None, None, None)    # default texture per kind, None draws the kind's color
+KIND_SENSORS = (False, False, False, True)  # sensors report contact but the player passes through them
+
+# pymunk collision types; hazards are reported by collision callbacks instead of being polled every tick
+PLAYER_COLLISION_TYPE = 1
+KIND_COLLISION_TYPES = tuple(kind + 2 for kind in range(len(KIND_NAMES)))
+
+def on_collision_begin(space: pymunk.Space, type_a, type_b, callback):
+    if hasattr(space, "on_collision"):     # pymunk 7+
+        space.on_collision(type_a, type_b, begin = lambda arbiter, space, data: callback(arbiter))
+    else:
+        handler = space.add_collision_handler(type_a, type_b)
+        handler.begin = lambda arbiter, space, data: callback(arbiter) or True
+
+class SpatialGrid:
+    # Uniform grid of cells -> items, used to find what overlaps a rectangle without scanning every item.
+    # Items come back in insertion order so overlapping objects still draw the same way they did in a full scan.
+    def __init__(self, cell_size = 256):
+        self.cell_size = cell_size
+        self.cells: dict[tuple[int, int], list] = {}
+        self.item_cells = {}
+        self.sequence = {}
+        self.counter = 0
+
+    def cell_range(self, x0, y0, x1, y1):
+        size = self.cell_size
+        for cx in range(int(x0 // size), int(x1 // size) + 1):
+            for cy in range(int(y0 // size), int(y1 // size) + 1):
+                yield cx, cy
+
+    def insert(self, item, x0, y0, x1, y1, sequence = None):
+        # sequence is the item's place in the order, by default after everything inserted so far
+        cells = list(self.cell_range(x0, y0, x1, y1))
+        for cell in cells:
+            self.cells.setdefault(cell, []).append(item)
+        self.item_cells[item] = cells
+        if sequence is None:
+            sequence = self.counter
+        self.sequence[item] = sequence
+        self.counter = max(self.counter, sequence + 1)
+
+    def insert_many(self, items, rects):
+        # insert for a whole batch; rects is an (n, 4) array of x0, y0, x1, y1. Items that fit in one cell (nearly all
+        # of a level) are grouped by cell with NumPy, only the bigger ones go through insert one by one.
+        if not len(items):
+            return
+        cells = np.floor(np.asarray(rects, np.float64) / self.cell_size).astype(np.int64)
+        single = (cells[:, 0] == cells[:, 2]) & (cells[:, 1] == cells[:, 3])
+        indices = np.flatnonzero(single)
+        keys = cells[indices, :2]
+        order = np.lexsort((keys[:, 1], keys[:, 0]))
+        keys, indices = keys[order], indices[order]
+        starts = np.flatnonzero(np.any(np.diff(keys, axis = 0), axis = 1)) + 1
+        for key, group in zip(map(tuple, keys[np.r_[0, starts]].tolist()) if len(keys) else (), np.split(indices, starts)):
+            members = [items[i] for i in group.tolist()]
+            self.cells.setdefault(key, []).extend(members)
+            self.item_cells.update(zip(members, ([key] for _ in members)))
+        self.sequence.update(zip(items, range(self.counter, self.counter + len(items))))
+        self.counter += len(items)
+        for i in np.flatnonzero(~single).tolist():
+            self.insert(items[i], *rects[i], self.sequence[items[i]])
+
+    def update(self, item, x0, y0, x1, y1):
+        # moves an item to a new rectangle, keeping its place in the order
+        sequence = self.sequence[item]
+        self.remove(item)
+        self.insert(item, x0, y0, x1, y1, sequence)
+
+    def remove(self, item):
+        for cell in self.item_cells.pop(item):
+            self.cells[cell].remove(item)
+            if not self.cells[cell]:
+                del self.cells[cell]
+        del self.sequence[item]
+
+    def query(self, x0, y0, x1, y1):
+        found = set()
+        for cell in self.cell_range(x0, y0, x1, y1):
+            found.update(self.cells.get(cell, ()))
+        return sorted(found, key = self.sequence.__getitem__)
+
+    def __len__(self):
+        return len(self.item_cells)
+
+class Camera:
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        self.x, self.y = 0, 0
+
+    def follow(self, position, bounds: pygame.Rect):
+        # Centers on the position but never shows anything outside the level; levels that fit the window don't scroll
+        self.x = int(min(max(bounds.left, position[0] - self.width / 2), bounds.right - self.width))
+        self.y = int(min(max(bounds.top, position[1] - self.height / 2), bounds.bottom - self.height))
+
+    def to_screen(self, x, y):
+        return x - self.x, y - self.y
+
+FONT_PATH = "Resources/fonts/CONSOLA.TTF"
+
+class Fonts:
+    # loaded on first use through assets, so importing this module doesn't open any files
+    @property
+    def small_font(self):
+        return assets.font(FONT_PATH, 16)
+
+    @property
+    def normal_font(self):
+        return assets.font(FONT_PATH, 32)
+
+fonts = Fonts()
+
+# Keys the simulation cares about, packed into a bitmask so a tick's input is just two small ints
+KEY_BITS = {pygame.K_a: 1, pygame.K_d: 2, pygame.K_s: 4, pygame.K_q: 8, pygame.K_e: 16, pygame.K_LCTRL: 32, pygame.K_SPACE: 64}
+ANY_KEY = 128   # set in "pressed" for any keydown, even for keys that aren't in KEY_BITS
+
+class InputState:
+    def __init__(self, held = 0, pressed = 0):
+        self.held = held            # keys currently held down
+        self.pressed = pressed      # keys that went down since the last tick
+
+    def __getitem__(self, key):
+        return bool(self.held & KEY_BITS.get(key, 0))
 
-class fonts:
-    small_font = pygame.font.Font("Resources/fonts/CONSOLA.TTF", 16)
-    normal_font = pygame.font.Font("Resources/fonts/CONSOLA.TTF", 32)
+    def was_pressed(self, key):
+        return bool(self.pressed & KEY_BITS.get(key, 0))
+
+    @property
+    def any_pressed(self):
+        return self.pressed != 0
+
+    @classmethod
+    def from_held(cls, held, previous = 0):
+        # for inputs that only say which keys are held (bots, replays of actions): keys that weren't held before
+        # count as pressed, like a keydown would
+        pressed = held & ~previous
+        return cls(held, pressed | ANY_KEY if pressed else 0)
+
+    @classmethod
+    def from_pygame(cls, pressed = 0):
+        keys = pygame.key.get_pressed()
+        held = 0
+        for key, bit in KEY_BITS.items():
+            if keys[key]:
+                held |= bit
+        return cls(held, pressed)
 
 class Engine:
-    def __init__(self, screen, fps = 500):
-        self.width = screen.get_width()
-        self.height = screen.get_height()
+    def __init__(self, screen = None, fps = 500, headless = False, tick_rate = None, max_substeps = 8, iterations = 10, interpolate = True):
+        self.headless = headless or screen is None
+        self.width = screen.get_width() if screen else 1080
+        self.height = screen.get_height() if screen else 720
         self.screen = screen
         self.running = True
         self.clock = pygame.time.Clock()
         self.space = pymunk.Space()
         self.space.gravity = (0, 980)  # Gravity directed downwards
-        self.draw_options = pymunk.pygame_util.DrawOptions(self.screen)
-        self.fps = fps
+        self.space.iterations = iterations
+        self.touched = set()    # kinds of objects the player started touching during the current tick
+        for kind in (SPIKE, FINISH, CHECKPOINT):
+            on_collision_begin(self.space, PLAYER_COLLISION_TYPE, KIND_COLLISION_TYPES[kind], lambda arbiter, kind = kind: touch(self, kind, arbiter, self.checkpoints))
+        self.checkpoints = {}   # checkpoint shape -> entity
+        self.draw_options = pymunk.pygame_util.DrawOptions(self.screen) if not self.headless else None
+        self.fps = fps                          # render cap
+        self.tick_rate = tick_rate or fps       # physics steps per second; headless engines only have this one
+        self.max_substeps = max_substeps
+        self.interpolate = interpolate
+        self.previous_state = None              # player (position, angle) before the last tick, for interpolation
         self.player: Player = None
-        self.objects: list[Object | Spike | FinishLine] = []
-        self.textures = {"player": pygame.transform.scale(pygame.image.load("Resources/player.png"), (50, 50)),
-                         "object": pygame.image.load("Resources/object.png")}  # Dictionary to hold textures
-        self.small_font = fonts.small_font
+        self.objects: list[Entity] = []
+        # Dictionary to hold textures; headless engines never draw, so they don't load any
+        self.textures = {} if self.headless else {"player": assets.image("Resources/player.png", (50, 50)), "object": assets.image("Resources/object.png")}
+        self.texture_cache = TextureCache(self.textures)
+        self.atlas = TextureAtlas(self.texture_cache)
+        self.queue = RenderQueue(self.atlas)        # the frame's draw commands, see draw
+        self.background: pygame.Surface = None     # static objects under the camera, see bake_static_layer
+        self.background_offset = None
+        self.tiles = OrderedDict()                  # (tx, ty) -> baked static objects of that tile, least recently used first
+        self.tile_size = 512
+        self.max_tiles = 48
+        self.grid = SpatialGrid()
+        self.camera = Camera(self.width, self.height)
+        self.level_bounds = pygame.Rect(0, 0, self.width, self.height)
+        self.drawn_rects: list[pygame.Rect] = []    # where dynamic things were drawn last frame
+        self.update_rects: list[pygame.Rect] = []   # parts of the screen that changed this frame
+        self.small_font = fonts.small_font if not self.headless else None
+        self.hud: list[Text] = []
+        self.profiler = FrameProfiler()
+        self.show_profiler = False
         self.initial_player_position = (0, 0)
-        self.particles: list[Particle] = []
+        self.respawn_position = (0, 0)      # level start, or the last checkpoint reached
+        self.particles = ParticleSystem(self)
         self.time = 0
+        self.ticks = 0
+        self.deaths = 0
+        self.accumulator = 0
+        self.inputs = InputState()
+        self.recorder: ReplayRecorder = None
+        self.stream: LevelStream = None     # set for levels that are streamed in chunks, see load_level
         self.quit_type = None
 
     def add_texture(self, name, filepath):
         try:
-            self.textures[name] = pygame.image.load(filepath)
+            self.textures[name] = assets.image(filepath)
+            self.texture_cache.invalidate(name)
         except pygame.error as e:
             print(f"Error loading texture {name}: {e}")
 
     def add_object(self, object):
-        self.objects.append(object)
-        self.space.add(object.body, object.shape)
+        self.add_objects([object])
+
+    def add_objects(self, objects, records = None):
+        # One space.add for the whole batch; objects sharing space.static_body don't add a body at all.
+        # records is the objects' (x, y, width, height) as an array if the caller has it already (load_level does),
+        # so the grid and the level bounds are built with array operations
+        if not objects:
+            return
+        bodies = {object.body for object in objects if object.body is not self.space.static_body}
+        self.space.add(*bodies, *(object.shape for object in objects))
+        self.objects += objects
+        self.checkpoints.update((object.shape, object) for object in objects if object.kind == CHECKPOINT)
+        if records is None:
+            records = [(*object.position, *object.size) for object in objects]
+        records = np.asarray(records, np.float64)
+        rects = np.concatenate((records[:, :2] - records[:, 2:] / 2, records[:, :2] + records[:, 2:] / 2), axis = 1)
+        self.grid.insert_many(objects, rects)
+        left, top = rects[:, :2].min(axis = 0).tolist()
+        right, bottom = rects[:, 2:].max(axis = 0).tolist()
+        self.level_bounds.union_ip((left, top, right - left, bottom - top))
+        self.invalidate_tiles(objects)
+
+    def close(self):
+        # stops the level stream's thread; call it when done with an engine that ran a streamed level
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+    def remove_objects(self, objects):
+        self.space.remove(*(object.shape for object in objects))
+        removed = set(objects)
+        self.objects = [object for object in self.objects if object not in removed]
+        for object in objects:
+            self.checkpoints.pop(object.shape, None)
+            self.grid.remove(object)
+        self.invalidate_tiles(objects)
+
+    def invalidate_tiles(self, objects):
+        # drops the baked tiles the objects are on, the rest of the level stays baked
+        size = self.tile_size
+        for object in objects if self.tiles else ():
+            x0, y0 = object.position[0] - object.size[0] / 2, object.position[1] - object.size[1] / 2
+            for tx in range(int(x0 // size), int((x0 + object.size[0]) // size) + 1):
+                for ty in range(int(y0 // size), int((y0 + object.size[1]) // size) + 1):
+                    self.tiles.pop((tx, ty), None)
+        self.background = None
 
     def add_player(self, player):
         self.player = player
         self.space.add(self.player.body, self.player.shape)
-        self.initial_player_position = player.body.position.x, player.body.position.y
+        self.initial_player_position = self.respawn_position = player.body.position.x, player.body.position.y
+        self.previous_state = (player.body.position, player.body.angle)
+
+    def snapshot(self):
+        # Everything a tick depends on: a copy of the whole space (cached contacts included, without them a restored
+        # run drifts away from the recorded one), which entity owns each of its shapes, and the engine's counters
+        owners = {obj.shape: obj for obj in self.objects}
+        owners[self.player.shape] = self.player
+        return (self.space.copy(), [owners[shape] for shape in self.space.shapes], list(self.objects),
+                dict(self.stream.loaded) if self.stream else None, self.stream.center if self.stream else None,
+                self.ticks, self.time, self.deaths, self.respawn_position, self.quit_type)
+
+    def restore(self, snapshot):
+        space, owners, objects, loaded, center, self.ticks, self.time, self.deaths, self.respawn_position, self.quit_type = snapshot
+        self.space = space.copy()       # copied again so the snapshot can be restored more than once
+        for owner, shape in zip(owners, self.space.shapes):
+            owner.shape, owner.body = shape, shape.body
+        # a streamed level may have had other chunks loaded back then
+        current, saved = set(self.objects), set(objects)
+        for obj in current - saved:
+            self.grid.remove(obj)
+        for obj in saved - current:
+            x0, y0 = obj.position[0] - obj.size[0] / 2, obj.position[1] - obj.size[1] / 2
+            self.grid.insert(obj, x0, y0, x0 + obj.size[0], y0 + obj.size[1])
+        if current != saved:
+            self.invalidate_tiles(list(current ^ saved))
+        self.objects = list(objects)
+        self.checkpoints = {obj.shape: obj for obj in objects if obj.kind == CHECKPOINT}
+        if self.stream:
+            self.stream.loaded, self.stream.center = dict(loaded), center
+        self.previous_state = (self.player.body.position, self.player.body.angle)
+        self.touched.clear()
+        self.particles.clear()
 
     def get_colliding_objects(self):
         colliding_objects = []
@@ -81,10 +518,12 @@ class Engine:
         query = self.space.bb_query(bb, self.player.shape.filter)
         for shape in query:
             if shape != self.player.shape:
-                colliding_objects.append(shape.type)
+                colliding_objects.append(KIND_NAMES[KIND_COLLISION_TYPES.index(shape.collision_type)])
         return colliding_objects
 
-    def blit_rotate(self, image, pos, originPos, angle):
+    def blit_rotate(self, name, size, pos, originPos, angle):
+        image = self.texture_cache.get(name, size)
+        angle = self.texture_cache.bucket(angle) * self.texture_cache.rotation_step
 
         # offset from pivot to center
         image_rect = image.get_rect(topleft = (pos[0] - originPos[0], pos[1]-originPos[1]))
@@ -97,24 +536,193 @@ class Engine:
         rotated_image_center = (pos[0] - rotated_offset.x, pos[1] - rotated_offset.y)
 
         # get a rotated image
-        rotated_image = pygame.transform.rotate(image, angle)
+        rotated_image = self.texture_cache.get(name, size, angle)
         rotated_image_rect = rotated_image.get_rect(center = rotated_image_center)
 
-        # rotate and blit the image
-        self.screen.blit(rotated_image, rotated_image_rect)
+        # rotate and queue the image
+        self.queue.blit(rotated_image, rotated_image_rect)
     
         # draw rectangle around the image
         #pygame.draw.rect(surf, (255, 0, 0), (*rotated_image_rect.topleft, *rotated_image.get_size()), 2)
 
     @property
     def dt(self):
-        return 1 / self.clock.get_fps() if self.clock.get_fps() != 0 else 1 / self.fps
+        # Physics runs on a fixed step so a run doesn't depend on how fast frames are rendered
+        return 1 / self.tick_rate
+
+    def tick(self, inputs: InputState):
+        self.inputs = inputs
+        if self.recorder:
+            self.recorder.record(inputs)
+        self.previous_state = (self.player.body.position, self.player.body.angle)
+        start_tick(self, inputs)
+        self.space.step(self.dt)
+        self.profiler.lap("step")
+        died_at, finished = finish_tick(self, inputs)
+        self.profiler.lap("player")
+
+        if died_at:
+            self.deaths += 1
+            self.particles.spawn(random.randint(5, 10), died_at, 300, 0.5, (255, 0, 0))
+            self.previous_state = (self.player.body.position, self.player.body.angle)     # don't draw a streak back to the respawn point
+
+        if finished:
+            self.quit_type = "finish"
+        self.profiler.lap("collisions")
+
+        self.particles.update(self.dt)
+        self.profiler.lap("particles")
+
+        if self.stream:
+            self.stream.update()
+
+        self.ticks += 1
+        self.time += self.dt
+
+    def advance(self, frame_time, held, pressed = 0):
+        # Fixed-timestep accumulator: step as many whole ticks as the elapsed time covers, but at most max_substeps,
+        # so a slow frame slows the game down instead of making the next frame even slower.
+        # Keydowns are handed to the first tick that runs so they aren't lost on frames with no tick.
+        self.accumulator = min(self.accumulator + frame_time, self.max_substeps * self.dt)
+        while self.accumulator >= self.dt and self.quit_type is None:
+            self.tick(InputState(held, pressed))
+            pressed = 0
+            self.accumulator -= self.dt
+        return pressed
+
+    def run_headless(self, max_time = 60, policy = None):
+        # Steps the level without a window as fast as possible; policy(engine) -> InputState
+        max_ticks = int(max_time * self.tick_rate)
+        while self.quit_type is None and self.ticks < max_ticks:
+            self.tick(policy(self) if policy else InputState())
+        return self.quit_type
+
+    def player_render_state(self):
+        # Where to draw the player: the leftover time in the accumulator says how far the frame is between the
+        # last two physics states, so rendering slower (or faster) than the physics doesn't stutter
+        body = self.player.body
+        if not self.interpolate or self.previous_state is None:
+            return body.position, body.angle
+        alpha = min(self.accumulator / self.dt, 1)
+        position, angle = self.previous_state
+        return position.interpolate_to(body.position, alpha), angle + (body.angle - angle) * alpha
+
+    def bake_tile(self, tx, ty):
+        # Objects are static, so each tile of the level is drawn once and reused until it's evicted
+        tile = pygame.Surface((self.tile_size, self.tile_size))
+        tile.fill((0, 0, 0))
+        x, y = tx * self.tile_size, ty * self.tile_size
+
+        # this loop runs for every object in view, so the common case (a solid block that fits the atlas) is appended inline
+        queue = RenderQueue(self.atlas, tile.get_rect())
+        commands, step, textures = queue.commands, self.atlas.solid_size, self.textures
+        solids = [(surface, block.x, block.y) for surface, block in map(self.atlas.solid, KIND_COLORS)]
+        for obj in self.grid.query(x, y, x + self.tile_size - 1, y + self.tile_size - 1):
+            width, height = obj.size
+            left, top = obj.position[0] - width // 2 - x, obj.position[1] - height // 2 - y
+            texture_name = obj.texture_name or KIND_TEXTURES[obj.kind]
+            if texture_name and texture_name in textures:
+                queue.blit(self.texture_cache.get(texture_name, obj.size), (left, top))
+            elif width <= step and height <= step:
+                surface, block_x, block_y = solids[obj.kind]
+                commands.append((surface, (left, top), (block_x, block_y, width, height)))
+            else:
+                queue.rect(KIND_COLORS[obj.kind], (left, top, width, height))
+        queue.flush(tile, False)
+        return tile
+
+    def get_tile(self, tx, ty):
+        tile = self.tiles.get((tx, ty))
+        if tile is None:
+            tile = self.tiles[(tx, ty)] = self.bake_tile(tx, ty)
+            if len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last = False)
+        else:
+            self.tiles.move_to_end((tx, ty))
+        return tile
+
+    def bake_static_layer(self):
+        # Composes the visible tiles into one background surface; redone only when the camera moves
+        self.background = pygame.Surface((self.width, self.height))
+        self.background.fill((0, 0, 0))
+        size = self.tile_size
+        queue = RenderQueue(self.atlas)
+        for ty in range(self.camera.y // size, (self.camera.y + self.height) // size + 1):
+            for tx in range(self.camera.x // size, (self.camera.x + self.width) // size + 1):
+                queue.blit(self.get_tile(tx, ty), self.camera.to_screen(tx * size, ty * size))
+        queue.flush(self.background, False)
+        self.background_offset = (self.camera.x, self.camera.y)
+
+    def draw(self):
+        # Everything is queued first and drawn by one Surface.blits at the end
+        position, angle = self.player_render_state()
+        self.camera.follow(position, self.level_bounds)
+        queue = self.queue
+        redrawn = self.background is None or self.background_offset != (self.camera.x, self.camera.y)
+        if redrawn:
+            self.bake_static_layer()
+            queue.blit(self.background, (0, 0))
+        else:
+            # only paint the background back over what moved last frame
+            for rect in self.drawn_rects:
+                queue.blit(self.background, rect, rect)
+        restored = len(queue)
+        self.profiler.lap("objects")
+
+        if self.player.texture_name:
+            self.blit_rotate(self.player.texture_name, (50, 50), self.camera.to_screen(*position), (25, 25), -math.degrees(angle))
+        else:
+            self.blit_rotate(("solid", (0, 255, 0)), (50, 50), self.camera.to_screen(*position), (25, 25), -math.degrees(angle))
+        self.particles.draw(queue)
+
+        self.draw_hud()
+        self.profiler.lap("hud")
+
+        rects = queue.flush(self.screen)
+        self.profiler.lap("sprites")
+        self.drawn_rects = rects[restored:]
+        self.update_rects = [self.screen.get_rect()] if redrawn else rects
+
+    def hud_lines(self):
+        fps = self.clock.get_fps()
+        cache = self.texture_cache
+        lines = [f"fps: {fps :.1f}",
+                 f"difference: {round(fps - self.fps)}" if fps <= self.fps else f"difference: +{round(fps - self.fps)}",
+                 f"time: {round(self.time, 2)}",
+                 f"physics: {self.tick_rate} Hz, {self.space.iterations} iterations",
+                 f"textures: {cache.hits} hits, {cache.misses} misses, {len(cache.surfaces)} cached ({cache.bytes / 1048576 :.1f} MB)"]
+        if self.show_profiler:
+            # percentiles are recomputed every 30 frames, in between the previous lines are reused
+            if self.profiler.frames % 30 == 0 or len(self.hud) <= len(lines):
+                lines.append(f"{'ms':<11}{'p50':>8}{'p95':>8}{'p99':>8}")
+                for phase, (p50, p95, p99) in self.profiler.percentiles().items():
+                    lines.append(f"{phase:<11}{p50:>8.3f}{p95:>8.3f}{p99:>8.3f}")
+            else:
+                lines += [text.text for text in self.hud[len(lines):]]
+        return lines
+
+    def draw_hud(self):
+        lines = self.hud_lines()
+        while len(self.hud) < len(lines):
+            self.hud.append(Text(self.small_font, "", "white", "black"))
+        del self.hud[len(lines):]
+
+        y = 0
+        for text, line in zip(self.hud, lines):
+            text.set_text(line)
+            self.queue.blit(text.rendered_text, (0, y))
+            y += text.height
+
+    def dump_profile(self, path = None):
+        os.makedirs("Data/profiles", exist_ok = True)
+        path = path or time.strftime("Data/profiles/frames_%Y%m%d_%H%M%S.csv")
+        print(f"saved frame timings to {self.profiler.dump(path)}")
 
     def run(self):
+        pressed = 0
         while True:
-            quit_ = False
             self.quit_type = None
-            self.is_key_pressed = False
+            self.profiler.start_frame()
 
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
@@ -122,66 +730,28 @@ class Engine:
                     sys.exit()
                 
                 if event.type == pygame.KEYDOWN:
-                    self.is_key_pressed = True
-                    if event.key == pygame.K_SPACE:
-                        self.player.body.velocity = (self.player.body.velocity[0], max(-600, self.player.body.velocity[1] - 300))
+                    if event.key == pygame.K_F3:
+                        self.show_profiler = not self.show_profiler
+                        continue
+                    if event.key == pygame.K_F4:
+                        self.dump_profile()
+                        continue
+                    pressed |= KEY_BITS.get(event.key, 0) | ANY_KEY
                     if event.key == pygame.K_ESCAPE:
-                        quit_ = True
                         self.quit_type = "quit"
+            self.profiler.lap("events")
 
-            self.space.step(self.dt)
-            self.screen.fill((0, 0, 0))
+            if self.quit_type is None:
+                pressed = self.advance(self.clock.get_time() / 1000, InputState.from_pygame().held, pressed)
 
-            for obj in self.objects:
-                if obj.texture_name and obj.texture_name in self.textures:
-                    texture = pygame.transform.scale(self.textures[obj.texture_name], obj.size)
-                    self.screen.blit(texture, (obj.body.position.x - obj.size[0] // 2, obj.body.position.y - obj.size[1] // 2))
-                else:
-                    if obj.shape.type == "object": color = (100, 100, 100)
-                    if obj.shape.type == "spike": color = (255, 0, 0)
-                    if obj.shape.type == "finish": color = (0, 255, 0)
-                    pygame.draw.rect(self.screen, color,
-                                    (obj.body.position.x - obj.size[0] // 2, obj.body.position.y - obj.size[1] // 2, obj.size[0], obj.size[1]))
-
-            self.player.update(self.is_key_pressed)
-
-            if "spike" in self.get_colliding_objects():
-                for i in range(random.randint(5, 10)):
-                    self.particles.append(Particle(self, (self.player.body.position.x, self.player.body.position.y),
-                                                   (random.randint(-300, 300), random.randint(-300, 300)), 0.5, (255, 0, 0)))
-                self.space.remove(self.player.shape)
-                self.add_player(Player(self, self.initial_player_position, self.player.texture_name))
-
-            if "finish" in self.get_colliding_objects():
-                quit_ = True
-                self.quit_type = "finish"
-
-            if self.player.texture_name:
-                self.blit_rotate(self.textures[self.player.texture_name], (self.player.body.position.x, self.player.body.position.y), (25, 25), -math.degrees(self.player.body.angle))
-            else:
-                surf = pygame.Surface((50, 50), pygame.SRCALPHA)
-                pygame.draw.rect(surf, (0, 255, 0), (0, 0, 50, 50))
-                self.blit_rotate(surf, (self.player.body.position.x, self.player.body.position.y), (25, 25), -math.degrees(self.player.body.angle))
-
-            for particle in self.particles:
-                particle.update()
-                particle.draw()
-                if particle.dead:
-                    self.particles.remove(particle)
-
-            text_1 = self.small_font.render(f"fps: {self.clock.get_fps() :.1f}", True, "white", "black")
-            self.screen.blit(text_1, (0, 0))
-            text_2 = self.small_font.render(f"difference: {round(self.clock.get_fps() - self.fps)}" if self.clock.get_fps() <= self.fps else \
-                                            f"difference: +{round(self.clock.get_fps() - self.fps)}", True, "white", "black")
-            self.screen.blit(text_2, (0, text_1.get_height()))
-            text_3 = self.small_font.render(f"time: {round(self.time, 2)}", True, "white", "black")
-            self.screen.blit(text_3, (0, text_1.get_height() + text_2.get_height()))
+            self.draw()
 
-            if quit_: break
+            if self.quit_type is not None: break
 
-            pygame.display.flip()
+            pygame.display.update(self.update_rects)
+            self.profiler.lap("display")
+            self.profiler.end_frame()
             self.clock.tick(self.fps)
-            self.time += self.dt
 
 
 class Player:
@@ -192,11 +762,22 @@ class Player:
         self.shape.density = 1
         self.shape.elasticity = 0.8
         self.shape.friction = 8.0
+        self.shape.collision_type = PLAYER_COLLISION_TYPE
         self.texture_name = texture_name
         self.engine = engine
 
-    def update(self, is_key_pressed):
-        keys = pygame.key.get_pressed()
+    def respawn(self, position):
+        # reuses the same body, so dying doesn't add anything to the space
+        self.body.position = position
+        self.body.velocity = (0, 0)
+        self.body.angle = 0
+        self.body.angular_velocity = 0
+        self.body.force = (0, 0)
+        self.body.torque = 0
+        self.engine.space.reindex_shapes_for_body(self.body)
+
+    def update(self, inputs: InputState):
+        keys = inputs
         
         # Determine the desired horizontal velocity
         vx = 0
@@ -215,236 +796,351 @@ class Player:
         # Apply horizontal velocity while maintaining current vertical velocity
         self.body.velocity = (min(max(-600, self.body.velocity[0] + vx), 600), self.body.velocity[1] + vy)
         
-        if is_key_pressed:
+        if inputs.any_pressed:
             if keys[pygame.K_q]:
                 self.body.velocity = (max(-600, self.body.velocity[0] - 300), self.body.velocity[1])
             if keys[pygame.K_e]:
                 self.body.velocity = (min(600, self.body.velocity[0] + 300), self.body.velocity[1])
 
-class Object:
-    def __init__(self, position, size, texture_name = None):
-        self.body = pymunk.Body(body_type = pymunk.Body.STATIC)
-        self.body.position = position
-        self.shape = pymunk.Poly.create_box(self.body, size)
-        self.shape.friction = 8.0
-        self.shape.elasticity = 0.4
-        self.texture_name = texture_name
-        self.size = size
-        self.shape.type = "object"
+# The rules of a tick for one player, shared by Engine.tick and env.VectorEnv (which steps many players in one space).
+# runner is whatever keeps that player's state: anything with player, touched and respawn_position.
 
-class Spike:
-    def __init__(self, position, size, texture_name = None):
-        self.body = pymunk.Body(body_type = pymunk.Body.STATIC)
-        self.body.position = position
-        self.shape = pymunk.Poly.create_box(self.body, size)
-        self.shape.friction = 8.0
-        self.shape.elasticity = 0.4
-        self.texture_name = texture_name
-        self.size = size
-        self.shape.type = "spike"
+def touch(runner, kind, arbiter, checkpoints):
+    # collision callback: remembers what the player started touching, a checkpoint also moves where it respawns
+    runner.touched.add(kind)
+    if kind == CHECKPOINT:
+        runner.respawn_position = checkpoints[arbiter.shapes[1]].position
 
-class FinishLine:
-    def __init__(self, position, size, texture_name = None):
-        self.body = pymunk.Body(body_type = pymunk.Body.STATIC)
-        self.body.position = position
-        self.shape = pymunk.Poly.create_box(self.body, size)
+def start_tick(runner, inputs: InputState):
+    # before space.step; a jump adds upward speed, capped so mashing it doesn't launch the player
+    body = runner.player.body
+    if inputs.was_pressed(pygame.K_SPACE):
+        body.velocity = (body.velocity[0], max(-600, body.velocity[1] - 300))
+    runner.touched.clear()
+
+def finish_tick(runner, inputs: InputState):
+    # after space.step, returns (where the player died or None, finished); touching a spike sends the player back
+    # to its respawn position
+    runner.player.update(inputs)
+    died_at = None
+    if SPIKE in runner.touched:
+        died_at = tuple(runner.player.body.position)
+        runner.player.respawn(runner.respawn_position)
+    return died_at, FINISH in runner.touched
+
+def create_static_box(position, size, body = None):
+    # With a shared body (normally space.static_body) the box is placed in world coordinates
+    # instead of getting a body of its own, which is what lets a level be added in one go
+    if body is None:
+        body = pymunk.Body(body_type = pymunk.Body.STATIC)
+        body.position = position
+        return body, pymunk.Poly.create_box(body, size)
+    x, y = position
+    w, h = size[0] / 2, size[1] / 2
+    return body, pymunk.Poly(body, [(x - w, y - h), (x + w, y - h), (x + w, y + h), (x - w, y + h)])
+
+class Entity:
+    # Every static thing in a level; what it is lives in kind, everything kind-specific is looked up in the KIND_ tables
+    __slots__ = ("kind", "position", "size", "texture_name", "body", "shape")
+
+    def __init__(self, kind, position, size, texture_name = None, body = None):
+        self.kind = kind
+        self.body, self.shape = create_static_box(position, size, body)
+        self.position = position
         self.shape.friction = 8.0
         self.shape.elasticity = 0.4
+        self.shape.collision_type = KIND_COLLISION_TYPES[kind]
+        self.shape.sensor = KIND_SENSORS[kind]
         self.texture_name = texture_name
         self.size = size
-        self.shape.type = "finish"
-
-def load_level(engine: Engine, level_file_path: str):
-    with open(level_file_path, "r") as level:
-        content = level.read()
-        content = content.replace("\n", "").split(";")
-        for line in content:
-            if line.startswith("player"):
-                _, x, y = line.split(" ")
-                engine.add_player(Player(engine, (float(x), float(y)), "player"))
-            if line.startswith("object"):
-                _, x, y, width, height = line.split(" ")
-                engine.add_object(Object((float(x), float(y)), (float(width), float(height))))
-            if line.startswith("spike"):
-                _, x, y, width, height = line.split(" ")
-                engine.add_object(Spike((float(x), float(y)), (float(width), float(height))))
-            if line.startswith("finish"):
-                _, x, y, width, height = line.split(" ")
-                engine.add_object(FinishLine((float(x), float(y)), (float(width), float(height))))
-        
-        level.close()
+
+# Levels with more entities than this are streamed in chunks. Loading a whole level is bound by pymunk creating a Poly
+# for every entity (about half of a 100k level's few seconds); streaming starts in milliseconds at any size, but pays
+# for it with a short stall on ticks that add a chunk, so levels below this are still loaded whole.
+STREAMING_THRESHOLD = 100000
+
+def load_level(engine: Engine, level_file_path: str, streaming = None):
+    # goes through the compiled copy of the level, which is (re)built from the .wowlvl when needed;
+    # streaming None decides by the size of the level
+    if streaming is None:
+        streaming = wowlvl.entity_count(level_file_path) > STREAMING_THRESHOLD
+    if streaming:
+        level = wowlvl.read_chunked(level_file_path)
+        if level.player is None:
+            raise ValueError(f"{level_file_path} has no player, it can't be streamed")
+        engine.add_player(Player(engine, level.player, "player"))
+        left, top, right, bottom = level.bounds
+        engine.level_bounds.union_ip(left, top, right - left, bottom - top)
+        engine.stream = LevelStream(engine, level)
+        engine.stream.update()
+    else:
+        level = wowlvl.read_level(level_file_path)
+        if level.player is not None:
+            engine.add_player(Player(engine, level.player, "player"))
+        objects = []
+        for kind, name in enumerate(KIND_NAMES):
+            for x, y, width, height in level.entities[name].tolist():
+                objects.append(Entity(kind, (x, y), (width, height), body = engine.space.static_body))
+        engine.add_objects(objects, np.concatenate([level.entities[name] for name in KIND_NAMES]))
+
+    if not engine.headless:
+        engine.camera.follow(engine.player.body.position, engine.level_bounds)
+        engine.bake_static_layer()
 
 class LevelEditor:
-    def __init__(self, screen: pygame.Surface):
+    # Everything in the level is one entry of entities (id -> (kind, x, y, width, height)), with a SpatialGrid over them
+    # for picking with the mouse. Every change goes through set_entity and is recorded as (key, before, after) diffs,
+    # so undo/redo only keep what changed, and each entity's line of the level file is cached, so saving is one join.
+    KIND_KEYS = {pygame.K_o: OBJECT, pygame.K_p: SPIKE, pygame.K_f: FINISH, pygame.K_c: CHECKPOINT, pygame.K_l: None}   # None places the player
+    EDIT_FPS = 120
+
+    def __init__(self, screen: pygame.Surface, level_file_path = None):
         self.screen = screen
         self.width, self.height = self.screen.get_width(), self.screen.get_height()
-        self.objects = []
-        self.spikes = []
-        self.finishes = []
+        self.entities: dict[int, tuple] = {}
+        self.lines: dict[int, str] = {}
+        self.grid = SpatialGrid(128)
+        self.next_id = 0
         self.player_pos = (self.width // 2, self.height // 2)
-        self.current_object_type = "object"
-        self.states = []
-        self.selected_object = None
+        self.current_kind = OBJECT
+        self.selected = None
+        self.history = []           # undo steps, each a list of (key, before, after); None means the entity doesn't exist
+        self.redo_history = []
+        self.editing = None         # (key, state before) of the WASD edit in progress, it goes into the history once the keys are released
         self.clock = pygame.time.Clock()
+        self.status = Text(fonts.small_font, "", "white", "black")
         self.content = ""
+        if level_file_path:
+            self.load(level_file_path)
+
+    def load(self, level_file_path):
+        level = wowlvl.read_level(level_file_path)
+        if level.player is not None:
+            self.player_pos = level.player
+        for kind, name in enumerate(KIND_NAMES):
+            for x, y, width, height in level.entities[name].tolist():
+                self.set_entity(self.new_key(), (kind, x, y, width, height))
+
+    def new_key(self):
+        self.next_id += 1
+        return self.next_id
+
+    def set_entity(self, key, state):
+        # the one place the level changes; state None removes the entity. Keys are handed out in creation order and
+        # double as the drawing and file order, so an entity brought back by undo lands exactly where it was.
+        if key == "player":
+            self.player_pos = state
+            return
+        if state is None:
+            del self.entities[key], self.lines[key]
+            self.grid.remove(key)
+            return
+        kind, x, y, width, height = state
+        if key in self.entities:
+            self.grid.update(key, x - width / 2, y - height / 2, x + width / 2, y + height / 2)
+        else:
+            self.grid.insert(key, x - width / 2, y - height / 2, x + width / 2, y + height / 2, key)
+        restored = key not in self.lines and self.lines and key < next(reversed(self.lines))
+        self.entities[key] = state
+        self.lines[key] = f"{KIND_NAMES[kind]} {format_number(x)} {format_number(y)} {format_number(width)} {format_number(height)};\n"
+        if restored:
+            self.lines = dict(sorted(self.lines.items()))
+
+    def do(self, changes):
+        self.finish_edit()
+        for key, before, after in changes:
+            self.set_entity(key, after)
+        self.history.append(changes)
+        self.redo_history.clear()
+
+    def undo(self):
+        self.finish_edit()
+        if self.history:
+            changes = self.history.pop()
+            for key, before, after in reversed(changes):
+                self.set_entity(key, before)
+            self.redo_history.append(changes)
+
+    def redo(self):
+        self.finish_edit()
+        if self.redo_history:
+            changes = self.redo_history.pop()
+            for key, before, after in changes:
+                self.set_entity(key, after)
+            self.history.append(changes)
+
+    def edit_selected(self, dx, dy, dw, dh):
+        # called every frame WASD is held; the whole hold becomes one undo step
+        if self.selected not in self.entities:
+            return
+        state = self.entities[self.selected]
+        if self.editing is None:
+            self.editing = (self.selected, state)
+        kind, x, y, width, height = state
+        self.set_entity(self.selected, (kind, x + dx, y + dy, max(1, width + dw), max(1, height + dh)))
+
+    def finish_edit(self):
+        if self.editing is not None:
+            key, before = self.editing
+            self.editing = None
+            after = self.entities.get(key)
+            if after != before:
+                self.history.append([(key, before, after)])
+                self.redo_history.clear()
+
+    def entity_at(self, x, y):
+        # topmost entity under the point, the grid gives them back in drawing order
+        for key in reversed(self.grid.query(x, y, x, y)):
+            kind, ex, ey, width, height = self.entities[key]
+            if abs(x - ex) <= width / 2 and abs(y - ey) <= height / 2:
+                return key
+        return None
+
+    def click(self, button, x, y):
+        hit = self.entity_at(x, y)
+        if button == 3:
+            if hit is not None:
+                self.do([(hit, self.entities[hit], None)])
+        elif button == 1:
+            if self.current_kind is None:
+                self.do([("player", self.player_pos, (x, y))])
+            elif hit is not None:
+                self.finish_edit()
+                self.selected = hit
+            else:
+                key = self.new_key()
+                self.do([(key, None, (self.current_kind, x, y, 50, 50))])
+                self.selected = key
+
+    def serialize(self):
+        return f"player {format_number(self.player_pos[0])} {format_number(self.player_pos[1])};\n" + "".join(self.lines.values())
+
+    def draw(self):
+        self.screen.fill((0, 0, 0))
+        for key in self.grid.query(0, 0, self.width, self.height):
+            kind, x, y, width, height = self.entities[key]
+            pygame.draw.rect(self.screen, KIND_COLORS[kind], (x - width / 2, y - height / 2, width, height))
+        if self.selected in self.entities:
+            kind, x, y, width, height = self.entities[self.selected]
+            pygame.draw.rect(self.screen, (255, 255, 255), (x - width / 2, y - height / 2, width, height), 2)
+        pygame.draw.rect(self.screen, (0, 0, 255), (self.player_pos[0] - 25, self.player_pos[1] - 25, 50, 50))
+
+        placing = "player" if self.current_kind is None else KIND_NAMES[self.current_kind]
+        self.status.set_text(f"placing: {placing} | entities: {len(self.entities)} | undo: {len(self.history)} redo: {len(self.redo_history)}")
+        self.screen.blit(self.status.rendered_text, (0, self.height - self.status.height))
 
-    @property
-    def dt(self):
-        return 1 / self.clock.get_fps() if self.clock.get_fps() != 0 else 1 / self.fps
-        
     def run(self):
+        # Sleeps until there's input while nothing is being edited; only a held WASD edit runs at EDIT_FPS
+        needs_redraw = True
         while True:
             quit_ = False
 
-            self.screen.fill((0, 0, 0))
+            if needs_redraw:
+                self.draw()
+                pygame.display.update()
+                needs_redraw = False
+
+            keys = pygame.key.get_pressed()
+            if keys[pygame.K_w] or keys[pygame.K_a] or keys[pygame.K_s] or keys[pygame.K_d]:
+                step = self.clock.tick(self.EDIT_FPS) / 1000
+                events = pygame.event.get()
+            else:
+                step = 0
+                events = [pygame.event.wait(IDLE_TIMEOUT), *pygame.event.get()]
+                self.clock.tick()   # the time spent waiting isn't part of the next edit
+
+            for event in events:
+                if event.type != pygame.NOEVENT:
+                    needs_redraw = True
 
-            for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     pygame.quit()
                     sys.exit()
 
                 if event.type == pygame.MOUSEBUTTONDOWN:
-                    if self.current_object_type == "object":
-                        self.objects.append([*pygame.mouse.get_pos(), 50, 50])
-                        self.selected_object = len(self.objects) - 1
-                    if self.current_object_type == "spike":
-                        self.spikes.append([*pygame.mouse.get_pos(), 50, 50])
-                        self.selected_object = len(self.spikes) - 1
-                    if self.current_object_type == "finish":
-                        self.finishes.append([*pygame.mouse.get_pos(), 50, 50])
-                        self.selected_object = len(self.finishes) - 1
-                    if self.current_object_type == "player":
-                        self.player_pos = pygame.mouse.get_pos()
-                    
-                    self.states.append((self.objects, self.spikes))
+                    self.click(event.button, *event.pos)
 
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_ESCAPE:
                         quit_ = True
-
+                    if event.key in self.KIND_KEYS:
+                        self.current_kind = self.KIND_KEYS[event.key]
                     if event.key == pygame.K_z:
-                        if self.states != []:
-                            self.objects = self.states[-1][0]
-                            self.spikes = self.states[-1][1]
-                    
-                    if event.key == pygame.K_o:
-                        self.current_object_type = "object"
-                        self.selected_object = len(self.objects)
-                    
-                    if event.key == pygame.K_p:
-                        self.current_object_type = "spike"
-                        self.selected_object = len(self.spikes)
-
-                    if event.key == pygame.K_f:
-                        self.current_object_type = "finish"
-                        self.selected_object = len(self.finishes)
-
-                    if event.key == pygame.K_l:
-                        self.current_object_type = "player"
-
+                        self.undo()
+                    if event.key == pygame.K_y:
+                        self.redo()
+                    if event.key in (pygame.K_DELETE, pygame.K_BACKSPACE) and self.selected in self.entities:
+                        self.do([(self.selected, self.entities[self.selected], None)])
                     if event.key == pygame.K_SPACE:
-                        content = f"player {self.player_pos[0]} {self.player_pos[1]};\n"
-                        for object in self.objects:
-                            content += f"object {object[0]} {object[1]} {object[2]} {object[3]};\n"
-                        for spike in self.spikes:
-                            content += f"spike {spike[0]} {spike[1]} {spike[2]} {spike[3]};\n"
-                        for finish in self.finishes:
-                            content += f"finish {finish[0]} {finish[1]} {finish[2]} {finish[3]};\n"
-                        self.content = content
-            
-                
+                        self.finish_edit()
+                        self.content = self.serialize()
+
+            # WASD resizes the selected entity, with LCTRL held it moves it
             keys = pygame.key.get_pressed()
-            if not keys[pygame.K_LCTRL]:
-                if keys[pygame.K_w]:
-                    if self.current_object_type == "object":
-                        if self.objects != []: self.objects[self.selected_object][3] += self.dt * 120
-                    if self.current_object_type == "spike":
-                        if self.spikes != []: self.spikes[self.selected_object][3] += self.dt * 120
-                    if self.current_object_type == "finish":
-                        if self.finishes != []: self.finishes[self.selected_object][3] += self.dt * 120
-                if keys[pygame.K_s]:
-                    if self.current_object_type == "object":
-                        if self.objects != []: self.objects[self.selected_object][3] -= self.dt * 120
-                    if self.current_object_type == "spike":
-                        if self.spikes != []: self.spikes[self.selected_object][3] -= self.dt * 120
-                    if self.current_object_type == "finish":
-                        if self.finishes != []: self.finishes[self.selected_object][3] -= self.dt * 120
-                if keys[pygame.K_a]:
-                    if self.current_object_type == "object":
-                        if self.objects != []: self.objects[self.selected_object][2] -= self.dt * 120
-                    if self.current_object_type == "spike":
-                        if self.spikes != []: self.spikes[self.selected_object][2] -= self.dt * 120
-                    if self.current_object_type == "finish":
-                        if self.finishes != []: self.finishes[self.selected_object][2] -= self.dt * 120
-                if keys[pygame.K_d]:
-                    if self.current_object_type == "object":
-                        if self.objects != []: self.objects[self.selected_object][2] += self.dt * 120
-                    if self.current_object_type == "spike":
-                        if self.spikes != []: self.spikes[self.selected_object][2] += self.dt * 120
-                    if self.current_object_type == "finish":
-                        if self.finishes != []: self.finishes[self.selected_object][2] += self.dt * 120
+            dx, dy = keys[pygame.K_d] - keys[pygame.K_a], keys[pygame.K_s] - keys[pygame.K_w]
+            if dx or dy:
+                if keys[pygame.K_LCTRL]:
+                    self.edit_selected(dx * step * 180, dy * step * 180, 0, 0)
+                else:
+                    self.edit_selected(0, 0, dx * step * 120, -dy * step * 120)
+                needs_redraw = True
             else:
-                if keys[pygame.K_w]:
-                    if self.current_object_type == "object":
-                        if self.objects != []: self.objects[self.selected_object][1] -= self.dt * 180
-                    if self.current_object_type == "spike":
-                        if self.spikes != []: self.spikes[self.selected_object][1] -= self.dt * 180
-                    if self.current_object_type == "finish":
-                        if self.finishes != []: self.finishes[self.selected_object][1] -= self.dt * 180
-                if keys[pygame.K_s]:
-                    if self.current_object_type == "object":
-                        if self.objects != []: self.objects[self.selected_object][1] += self.dt * 180
-                    if self.current_object_type == "spike":
-                        if self.spikes != []: self.spikes[self.selected_object][1] += self.dt * 180
-                    if self.current_object_type == "finish":
-                        if self.finishes != []: self.finishes[self.selected_object][1] += self.dt * 180
-                if keys[pygame.K_a]:
-                    if self.current_object_type == "object":
-                        if self.objects != []: self.objects[self.selected_object][0] -= self.dt * 180
-                    if self.current_object_type == "spike":
-                        if self.spikes != []: self.spikes[self.selected_object][0] -= self.dt * 180
-                    if self.current_object_type == "finish":
-                        if self.finishes != []: self.finishes[self.selected_object][0] -= self.dt * 180
-                if keys[pygame.K_d]:
-                    if self.current_object_type == "object":
-                        if self.objects != []: self.objects[self.selected_object][0] += self.dt * 180
-                    if self.current_object_type == "spike":
-                        if self.spikes != []: self.spikes[self.selected_object][0] += self.dt * 180
-                    if self.current_object_type == "finish":
-                        if self.finishes != []: self.finishes[self.selected_object][0] += self.dt * 180
-
-            for object in self.objects:
-                pygame.draw.rect(self.screen, (100, 100, 100), (object[0] - object[2] / 2, object[1] - object[3] / 2, object[2], object[3]))
-            for spike in self.spikes:
-                pygame.draw.rect(self.screen, (255, 0, 0), (spike[0] - spike[2] / 2, spike[1] - spike[3] / 2, spike[2], spike[3]))
-            for finish in self.finishes:
-                pygame.draw.rect(self.screen, (0, 255, 0), (finish[0] - finish[2] / 2, finish[1] - finish[3] / 2, finish[2], finish[3]))
-            
-            pygame.draw.rect(self.screen, (0, 0, 255), (self.player_pos[0] - 25, self.player_pos[1] - 25, 50, 50))
+                self.finish_edit()
 
             if quit_: break
 
-            pygame.display.update()
-            self.clock.tick()
+def format_number(value):
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+# How long idle loops block waiting for input before calling update() anyway, in milliseconds
+IDLE_TIMEOUT = 250
 
 class MenuBaseplate:
-    def __init__(self, screen):
+    # Menus only redraw when something changed: the loop sleeps in pygame.event.wait until there is input (or
+    # IDLE_TIMEOUT passes, so update() can notice background work finishing), and max_fps caps bursts of redraws
+    # while the mouse is moving.
+    def __init__(self, screen, max_fps = 60):
         self.screen = screen
         self.gui = GUI(self.screen)
-        
+        self.gui.mouse = pygame.mouse.get_pos()
+        self.clock = pygame.time.Clock()
+        self.max_fps = max_fps
+        self.needs_redraw = True
+
+    def update(self):
+        # returns whether the menu has to be drawn again
+        return False
+
+    def ready(self):
+        # whether the frame being drawn shows what the menu is for, only such a frame counts as the first one
+        return True
+
+    def redraw(self):
+        self.screen.fill((0, 0, 0))
+        self.gui.draw()
+        pygame.display.update()
+        if self.ready():
+            assets.frame_shown()
+        self.needs_redraw = False
+
+    def frame(self):
+        # update runs before drawing, so even the first frame has the menu's contents
+        if self.update():
+            self.needs_redraw = True
+        if self.needs_redraw:
+            self.redraw()
+            self.clock.tick(self.max_fps)
+
+        for event in [pygame.event.wait(IDLE_TIMEOUT), *pygame.event.get()]:
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+            if self.gui.handle_event(event):
+                self.needs_redraw = True
+
     def run(self):
         while True:
-            self.screen.fill((0, 0, 0))
-            
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-            
-            self.gui.update()
-            self.gui.draw()
-
-            pygame.display.update()
+            self.frame()
 
 def generate_random_level_name():
     name = ""
@@ -457,42 +1153,65 @@ def generate_random_level_name():
 class MainMenu(MenuBaseplate):
     def __init__(self, screen):
         super().__init__(screen)
-        def load_buttons():
-            level_count = 0
-            with open("Data/level_records.json", "r") as file:
-                self.high_scores = json.loads(file.read())
-                file.close()
-            for file in os.listdir("Levels"):
-                if file.endswith(".wowlvl"):
-                    if not file[:-7] in self.high_scores:
-                        self.high_scores[file[:-7]] = "None"
-
-                    def start_level(file = file):
-                        settings = json.loads(open("Resources/settings.json", "r").read())
-                        fps = settings["fps"]
-                        engine = Engine(self.screen, fps)
-                        load_level(engine, f"Levels/{file}")
-                        engine.run()
-                        if engine.quit_type == "finish":
-                            highscore = round(engine.time, 2)
-
-                            if self.high_scores[file[:-7]] == "None" or highscore < self.high_scores[file[:-7]]:
-                                self.high_scores[file[:-7]] = highscore
-                                with open("Data/level_records.json", "w") as file_:
-                                    file_.write(json.dumps(self.high_scores, indent = 4))
-                                    file_.close()
-                                load_buttons()
-
-                    self.__setattr__(f"{file[:-7]}_level", start_level) # __setattr__ bc no way i am doing that in any other way
-                    self.gui.buttons.append(Button(self.screen, 
-                                                0, 50 * level_count, 1080, 50, 
-                                                "white", "lime", 
-                                                Text(fonts.normal_font, f"{file[:-7]} | time: {self.high_scores[file[:-7]]}", "black"),
-                                                self.__getattribute__(f"{file[:-7]}_level")))
-                    level_count += 1
-            self.gui.buttons.append(Button(self.screen, 0, 50 * level_count, 1080, 50, "white", "lime", Text(fonts.normal_font, "Start level editor", "black"), self.start_level_editor))
-
-        load_buttons()
+        self.records = RecordStore()
+        self.high_scores = self.records.best_times()
+        # levels come from the library's index right away and get refreshed by a background scan
+        self.library = LevelLibrary()
+        self.library_version = None
+        self.level_list = ListView(self.screen, 0, 0, self.screen.get_width(), self.screen.get_height(), 50, self.make_row)
+        self.gui.lists.append(self.level_list)
+        self.library.scan_async()
+        assets.preload(images = [("Resources/player.png", (50, 50)), ("Resources/object.png", None)])     # what starting a level needs
+
+    def update(self):
+        if self.library_version != self.library.version:
+            self.library_version = self.library.version
+            self.levels = self.library.levels
+            self.level_list.set_count(len(self.levels) + 1)     # last row starts the level editor
+            return True
+        if self.library.collect_thumbnails():
+            self.level_list.refresh()       # rebuilds the visible rows with their finished previews
+            return True
+        return assets.first_frame is None and self.ready()     # a scan that found nothing new still finishes the first frame
+
+    def ready(self):
+        # the level list is up once it has the levels, from the index or (the first time) from the scan
+        return self.library_version is not None and (bool(self.levels) or not self.library.scanning.is_alive())
+
+    def make_row(self, index, x, y, width, height):
+        if index == len(self.levels):
+            return Button(self.screen, x, y, width, height, "white", "lime", Text(fonts.normal_font, "Start level editor", "black"), self.start_level_editor)
+        level = self.levels[index]
+        return Button(self.screen, x, y, width, height, "white", "lime",
+                      Text(fonts.normal_font, f"{level.name} | time: {self.high_scores.get(level.name, 'None')}", "black"),
+                      lambda: self.start_level(level), self.library.thumbnail(level, KIND_COLORS))
+
+    def start_level(self, level: LevelInfo):
+        name = level.name
+        settings = assets.settings()
+        engine = Engine(self.screen, settings["fps"], tick_rate = settings["physics_tick_rate"], max_substeps = settings["max_substeps"],
+                        iterations = settings["solver_iterations"], interpolate = settings["interpolate"])
+        load_level(engine, level.path)
+        os.makedirs("Data/replays", exist_ok = True)
+        replay_path = f"Data/replays/{name} {time.strftime('%Y%m%d_%H%M%S')}.wowrep"
+        engine.recorder = ReplayRecorder(replay_path + ".tmp", engine.tick_rate, level_hash(level.path), engine.space.iterations)
+        finished = False
+        try:
+            engine.run()
+            finished = engine.quit_type == "finish"
+        finally:
+            # closing the window exits from inside run, which mustn't leave a half-written replay behind
+            engine.close()
+            engine.recorder.close()
+            if not finished:
+                os.remove(replay_path + ".tmp")
+        if not finished:
+            return
+        # every finished run goes into the history together with its inputs
+        os.replace(replay_path + ".tmp", replay_path)
+        if self.records.add_run(name, round(engine.time, 2), replay_path):
+            self.high_scores = self.records.best_times()    # also picks up records set by other instances
+            self.level_list.refresh()
                             
     def start_level_editor(self):
         level_editor = LevelEditor(self.screen)
@@ -505,6 +1224,7 @@ class MainMenu(MenuBaseplate):
         print(f"saved new level as {name}")
 
 if __name__ == "__main__":
+    pygame.init()
     res = width, height = 1080, 720
     screen = pygame.display.set_mode(res)
     menu = MainMenu(screen)
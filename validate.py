@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from twow import Engine, InputState, KEY_BITS, ANY_KEY, load_level, load_settings
+import pygame
+import wowlvl
+
+LEFT, RIGHT, JUMP = KEY_BITS[pygame.K_a], KEY_BITS[pygame.K_d], KEY_BITS[pygame.K_SPACE] | ANY_KEY
+ESCAPE_MARGIN = 2000    # how far outside the level's bounds an attempt is given up on
+
+# policies time everything in seconds through engine.dt, so they play the same at any tick rate
+def hold(held, jump_every = 0):
+    def policy(engine):
+        jump = jump_every and engine.ticks % max(1, round(jump_every / engine.dt)) == 0
+        return InputState(held, JUMP if jump else 0)
+    return policy
+
+def random_inputs(seed, change_every = 0.5, jumps_per_second = 1):
+    # holds a random direction for a while, then picks again; jumps now and then
+    rng = random.Random(seed)
+    state = [0]
+    def policy(engine):
+        if engine.ticks % max(1, round(change_every / engine.dt)) == 0:
+            state[0] = rng.choice((0, LEFT, RIGHT, RIGHT, LEFT | KEY_BITS[pygame.K_LCTRL], RIGHT | KEY_BITS[pygame.K_LCTRL]))
+        return InputState(state[0], JUMP if rng.random() < jumps_per_second * engine.dt else 0)
+    return policy
+
+POLICIES = {
+    "idle": lambda seed: hold(0),
+    "left": lambda seed: hold(LEFT),
+    "right": lambda seed: hold(RIGHT),
+    "hop-left": lambda seed: hold(LEFT, 1),
+    "hop-right": lambda seed: hold(RIGHT, 1),
+    "random": random_inputs,
+}
+
+def attempt(level_file_path, policy_name, seed, max_time, fps):
+    engine = Engine(None, fps)
+    try:
+        load_level(engine, level_file_path)
+        policy = POLICIES[policy_name](seed)
+        max_ticks = int(max_time * fps)
+        # a player that falls far below everything in the level is never coming back, and neither is one
+        # that flew far above it or out past its sides
+        bounds = engine.level_bounds.inflate(2 * ESCAPE_MARGIN, 2 * ESCAPE_MARGIN)
+
+        start = time.perf_counter()
+        while engine.quit_type is None and engine.ticks < max_ticks:
+            engine.tick(policy(engine))
+            x, y = engine.player.body.position
+            if y > bounds.bottom:
+                engine.quit_type = "fell"
+            elif y < bounds.top or not bounds.left <= x <= bounds.right:
+                engine.quit_type = "escaped"
+        elapsed = time.perf_counter() - start
+    finally:
+        engine.close()
+
+    return {"policy": policy_name, "seed": seed, "result": engine.quit_type or "timeout",
+            "time": round(engine.time, 2), "deaths": engine.deaths, "ticks": engine.ticks,
+            "ticks_per_second": round(engine.ticks / elapsed) if elapsed else None}
+
+def validate_level(level_file_path, policies, seeds, max_time, fps):
+    report = {"level": level_file_path, "reached_finish": False, "finish_time": None, "deaths": 0, "ticks": 0, "attempts": []}
+    try:
+        engine = Engine(None, fps)
+        load_level(engine, level_file_path)
+        engine.close()      # only looked at, the attempts run their own engines
+        report["entities"] = wowlvl.entity_count(level_file_path)     # engine.objects only has the loaded chunks of a streamed level
+        if engine.player is None:
+            report["error"] = "level has no player"
+            return report
+        if not len(wowlvl.read_level(level_file_path).entities["finish"]):     # a streamed level only has the chunks around the player loaded
+            report["error"] = "level has no finish line"
+
+        start = time.perf_counter()
+        for policy_name in policies:
+            for seed in range(seeds if policy_name == "random" else 1):
+                result = attempt(level_file_path, policy_name, seed, max_time, fps)
+                report["attempts"].append(result)
+                report["deaths"] += result["deaths"]
+                report["ticks"] += result["ticks"]
+                if result["result"] == "finish" and (report["finish_time"] is None or result["time"] < report["finish_time"]):
+                    report["reached_finish"] = True
+                    report["finish_time"] = result["time"]
+        elapsed = time.perf_counter() - start
+        report["ticks_per_second"] = round(report["ticks"] / elapsed) if elapsed else None
+    except Exception as e:
+        report["error"] = f"{type(e).__name__}: {e}"
+    return report
+
+def find_levels(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for file in sorted(os.listdir(path)):
+                if file.endswith(".wowlvl"):
+                    yield os.path.join(path, file)
+        else:
+            yield path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Run every level headlessly with scripted/random inputs and report which ones can be finished")
+    parser.add_argument("paths", nargs = "*", default = ["Levels"], help = "level files or directories (default: Levels)")
+    parser.add_argument("--policies", default = ",".join(POLICIES), help = f"comma separated, out of {', '.join(POLICIES)}")
+    parser.add_argument("--seeds", type = int, default = 4, help = "number of runs of the random policy per level")
+    parser.add_argument("--max-time", type = float, default = 30, help = "simulated seconds per attempt")
+    parser.add_argument("--fps", type = int, default = load_settings()["physics_tick_rate"], help = "physics tick rate (default: physics_tick_rate from settings.json)")
+    parser.add_argument("--jobs", type = int, default = os.cpu_count(), help = "worker processes")
+    parser.add_argument("--output", "-o", help = "write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    levels = list(find_levels(args.paths))
+    policies = args.policies.split(",")
+    start = time.perf_counter()
+    with ProcessPoolExecutor(args.jobs) as pool:
+        reports = list(pool.map(validate_level, levels, *([item] * len(levels) for item in (policies, args.seeds, args.max_time, args.fps)),
+                                chunksize = max(1, len(levels) // (args.jobs * 4))))
+    elapsed = time.perf_counter() - start
+
+    output = {"levels": reports, "summary": {"levels": len(reports), "finishable": sum(report["reached_finish"] for report in reports),
+                                             "errors": sum("error" in report for report in reports), "seconds": round(elapsed, 2),
+                                             "jobs": args.jobs}}
+    text = json.dumps(output, indent = 4)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+    else:
+        print(text)
@@ -0,0 +1,232 @@
+import os
+import sys
+import mmap
+import struct
+import hashlib
+import threading
+import numpy as np
+
+# Compiled levels (.wowlvlc) are a fixed header followed by one block of float32 (x, y, width, height)
+# records per entity kind, in KINDS order. They're memory-mapped and handed out as NumPy views, so
+# loading doesn't parse anything. The header remembers which source file it was built from, so a
+# compiled file that's older than its .wowlvl is rebuilt automatically. Compiled files are named after
+# a hash of the source's absolute path, so levels with the same file name in different folders don't
+# share one.
+KINDS = ("object", "spike", "finish", "checkpoint")
+MAGIC = b"WOWLVLC\0"
+VERSION = 2
+HEADER = struct.Struct("<8sHHqQ20s?3x2f" + "I" * len(KINDS))    # ..., source mtime, source size, source sha1, has player, player x, y, counts
+COMPILED_DIR = "Data/compiled"
+
+# Chunked levels (.wowchunks) are for levels too big to put in the space at once. Every entity is stored as float32
+# (kind, x, y, width, height) in the square chunk its center is in, sorted by chunk, with a table of where each chunk
+# starts; entities bigger than a chunk go into GLOBAL_CHUNK, which is always loaded. The header starts like HEADER so
+# the same up-to-date check works for both.
+CHUNK_MAGIC = b"WOWCHNK\0"
+CHUNK_VERSION = 1
+CHUNK_HEADER = struct.Struct("<8sHHqQ20s?3x2f4ffII")   # ..., has player, player x, y, bounds, chunk size, chunk count, entity count
+CHUNK_ENTRY = np.dtype([("cx", "<i4"), ("cy", "<i4"), ("offset", "<u4"), ("count", "<u4")])
+CHUNK_SIZE = 1024
+GLOBAL_CHUNK = (-2 ** 31, -2 ** 31)
+
+class LevelData:
+    def __init__(self, player, entities, source = None):
+        self.player = player            # (x, y) or None
+        self.entities = entities        # kind -> float32 array of shape (n, 4)
+        self.source = source            # (mtime, size, sha1) of the .wowlvl it was compiled from
+
+    def __len__(self):
+        return sum(len(records) for records in self.entities.values())
+
+def parse_level(content):
+    player = None
+    records = {kind: [] for kind in KINDS}
+    for line in content.replace("\n", "").split(";"):
+        parts = line.split()
+        if not parts:
+            continue
+        if parts[0] == "player":
+            player = (float(parts[1]), float(parts[2]))
+        elif parts[0] in records:
+            records[parts[0]].append(parts[1:5])
+    return LevelData(player, {kind: np.array(rows, np.float32).reshape(-1, 4) for kind, rows in records.items()})
+
+def cache_name(level_file_path):
+    # the file name for readability, the hash so it's unique per source file
+    stem = os.path.splitext(os.path.basename(level_file_path))[0]
+    return f"{stem}.{hashlib.sha1(os.path.abspath(level_file_path).encode()).hexdigest()[:16]}"
+
+def compiled_path(level_file_path):
+    return os.path.join(COMPILED_DIR, cache_name(level_file_path) + ".wowlvlc")
+
+def compile_level(level_file_path, output_path = None):
+    output_path = output_path or compiled_path(level_file_path)
+    with open(level_file_path, "rb") as file:
+        source = file.read()
+    stat = os.stat(level_file_path)
+    level = parse_level(source.decode())
+
+    header = HEADER.pack(MAGIC, VERSION, 0, stat.st_mtime_ns, stat.st_size, hashlib.sha1(source).digest(),
+                         level.player is not None, *(level.player or (0, 0)),
+                         *(len(level.entities[kind]) for kind in KINDS))
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok = True)
+    # write next to the target and rename so nobody maps a half-written file; the temporary name is
+    # unique per process and thread because the menu's library scan may compile the same level concurrently
+    temporary_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(header)
+        for kind in KINDS:
+            file.write(level.entities[kind].astype("<f4").tobytes())
+    os.replace(temporary_path, output_path)
+    return output_path
+
+def read_header(path, header_struct = HEADER, magic = MAGIC, version = VERSION):
+    with open(path, "rb") as file:
+        data = file.read(header_struct.size)
+    if len(data) < header_struct.size:
+        return None
+    header = header_struct.unpack(data)
+    if header[0] != magic or header[1] != version:
+        return None
+    return header
+
+def is_up_to_date(level_file_path, path, header_struct = HEADER, magic = MAGIC, version = VERSION):
+    if not os.path.exists(path):
+        return False
+    header = read_header(path, header_struct, magic, version)
+    return header is not None and matches_source(level_file_path, header[3:6])
+
+def matches_source(level_file_path, source):
+    # source is (mtime, size, sha1) from a compiled header
+    mtime, size, digest = source
+    stat = os.stat(level_file_path)
+    if stat.st_size != size:
+        return False
+    if stat.st_mtime_ns == mtime:
+        return True
+    with open(level_file_path, "rb") as file:   # touched but maybe not changed, only the hash can tell
+        return hashlib.sha1(file.read()).digest() == digest
+
+def load_compiled(path):
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+    header = HEADER.unpack_from(buffer)
+    has_player, x, y = header[6:9]
+    offset = HEADER.size
+    entities = {}
+    for kind, count in zip(KINDS, header[9:]):
+        # views straight into the mapping; the arrays keep it alive
+        entities[kind] = np.frombuffer(buffer, "<f4", count * 4, offset).reshape(count, 4)
+        offset += count * 16
+    return LevelData((x, y) if has_player else None, entities, header[3:6])
+
+def read_level(level_file_path, attempts = 3):
+    # Another process may replace the compiled file between the up-to-date check and mapping it, so what
+    # got mapped is checked against the source again; if it keeps changing under us, parse the source
+    path = compiled_path(level_file_path)
+    for _ in range(attempts):
+        if not is_up_to_date(level_file_path, path):
+            compile_level(level_file_path, path)
+        level = load_compiled(path)
+        if matches_source(level_file_path, level.source):
+            return level
+    with open(level_file_path, "r") as file:
+        return parse_level(file.read())
+
+class ChunkedLevel:
+    def __init__(self, player, bounds, chunk_size, chunks, records, source = None):
+        self.player = player            # (x, y) or None
+        self.bounds = bounds            # (left, top, right, bottom) of all entities
+        self.chunk_size = chunk_size
+        self.chunks = chunks            # (cx, cy) -> (first record, count)
+        self.records = records          # float32 (n, 5) of kind, x, y, width, height, sorted by chunk
+        self.source = source            # (mtime, size, sha1) of the .wowlvl it was compiled from
+
+    def chunk(self, key):
+        offset, count = self.chunks.get(key, (0, 0))
+        return self.records[offset:offset + count]
+
+    def __len__(self):
+        return len(self.records)
+
+def chunked_path(level_file_path):
+    return os.path.join(COMPILED_DIR, cache_name(level_file_path) + ".wowchunks")
+
+def compile_chunked(level_file_path, output_path = None, chunk_size = CHUNK_SIZE):
+    output_path = output_path or chunked_path(level_file_path)
+    with open(level_file_path, "rb") as file:
+        source = file.read()
+    stat = os.stat(level_file_path)
+    level = parse_level(source.decode())
+
+    records = np.concatenate([np.column_stack((np.full(len(level.entities[kind]), i, np.float32), level.entities[kind]))
+                              for i, kind in enumerate(KINDS)]).astype(np.float32)
+    if len(records):
+        half = records[:, 3:5] / 2
+        bounds = (*(records[:, 1:3] - half).min(axis = 0).tolist(), *(records[:, 1:3] + half).max(axis = 0).tolist())
+    else:
+        bounds = (0, 0, 0, 0)
+    cx = np.floor(records[:, 1] / chunk_size).astype(np.int64)
+    cy = np.floor(records[:, 2] / chunk_size).astype(np.int64)
+    big = records[:, 3:5].max(axis = 1) > chunk_size
+    cx[big], cy[big] = GLOBAL_CHUNK
+    order = np.lexsort((cy, cx))
+    records, cx, cy = records[order], cx[order], cy[order]
+    keys, offsets, counts = np.unique(np.column_stack((cx, cy)), axis = 0, return_index = True, return_counts = True)
+    table = np.zeros(len(keys), CHUNK_ENTRY)
+    if len(keys):
+        table["cx"], table["cy"] = keys[:, 0], keys[:, 1]
+        table["offset"], table["count"] = offsets, counts
+
+    header = CHUNK_HEADER.pack(CHUNK_MAGIC, CHUNK_VERSION, 0, stat.st_mtime_ns, stat.st_size, hashlib.sha1(source).digest(),
+                               level.player is not None, *(level.player or (0, 0)), *bounds, chunk_size, len(table), len(records))
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok = True)
+    temporary_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(header)
+        file.write(table.tobytes())
+        file.write(records.astype("<f4").tobytes())
+    os.replace(temporary_path, output_path)
+    return output_path
+
+def load_chunked(path):
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+    header = CHUNK_HEADER.unpack_from(buffer)
+    has_player, x, y = header[6:9]
+    bounds, chunk_size, chunk_count, count = header[9:13], header[13], header[14], header[15]
+    table = np.frombuffer(buffer, CHUNK_ENTRY, chunk_count, CHUNK_HEADER.size)
+    chunks = {(cx, cy): (offset, n) for cx, cy, offset, n in table.tolist()}
+    records = np.frombuffer(buffer, "<f4", count * 5, CHUNK_HEADER.size + table.nbytes).reshape(count, 5)
+    return ChunkedLevel((x, y) if has_player else None, bounds, chunk_size, chunks, records, header[3:6])
+
+def read_chunked(level_file_path, attempts = 3):
+    # checked after mapping like read_level; there's no parsed fallback, a chunked level has to come from a file
+    path = chunked_path(level_file_path)
+    for _ in range(attempts):
+        if not is_up_to_date(level_file_path, path, CHUNK_HEADER, CHUNK_MAGIC, CHUNK_VERSION):
+            compile_chunked(level_file_path, path)
+        level = load_chunked(path)
+        if matches_source(level_file_path, level.source):
+            return level
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.private"
+    level = load_chunked(compile_chunked(level_file_path, temporary_path))
+    try:
+        os.remove(temporary_path)   # the mapping stays valid after the file is gone
+    except OSError:                 # except on Windows, where it's left in the cache folder
+        pass
+    return level
+
+def entity_count(level_file_path):
+    # from the compiled header, without touching the entity data
+    path = compiled_path(level_file_path)
+    if not is_up_to_date(level_file_path, path):
+        compile_level(level_file_path, path)
+    header = read_header(path)
+    if header is None or not matches_source(level_file_path, header[3:6]):
+        return len(read_level(level_file_path))
+    return sum(header[9:])
+
+if __name__ == "__main__":
+    for level_file_path in sys.argv[1:]:
+        print(f"compiled {level_file_path} -> {compile_level(level_file_path)}")